@@ -11,7 +11,8 @@ from django.contrib.auth import authenticate, login, logout
 from django.urls import reverse, reverse_lazy
 from django.views import View
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.cache import cache_page
+
+from mysite.caching import cache_page_swr
 
 from .models import User
 from django.views.generic import TemplateView, CreateView, ListView, DetailView
@@ -103,7 +104,7 @@ def set_cookies_view(request: HttpRequest) -> HttpResponse:
     return response
 
 
-@cache_page(60 +2)
+@cache_page_swr(60 +2)
 def get_cookies_view(request: HttpRequest) -> HttpResponse:
     value = request.COOKIES.get('fizz', 'default_value')
     return HttpResponse(f'Cookie value: fizz={value!r} + {random()}')
@@ -0,0 +1,77 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils import translation
+from django.utils.safestring import mark_safe
+
+from .models import Article
+
+# Rendered article bodies, a save changes last_modified and so the key
+ARTICLE_FRAGMENT_KEY = 'blogapp:article:{pk}:{stamp}:{language}'
+
+# Rendered bodies are dropped after this time even if the article did not change
+ARTICLE_FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+ARTICLE_FRAGMENT_TEMPLATE = 'blogapp/article_fragment.html'
+
+# The generated feed by URL scheme, the links in it are absolute
+FEED_KEY = 'blogapp:feed:latest:{scheme}'
+
+# The feed is generated again after this time even if no article changed
+FEED_TIMEOUT = 60 * 60
+
+
+def get_fragment_key(pk, last_modified, language) -> str:
+    return ARTICLE_FRAGMENT_KEY.format(pk=pk, stamp=last_modified.timestamp(), language=language)
+
+
+def load_article(pk) -> Article:
+    # Everything the fragment shows, in two queries
+    return (
+        Article.objects
+        .select_related('author__user', 'category')
+        .prefetch_related('tags')
+        .get(pk=pk)
+    )
+
+
+def render_article_fragment(article: Article, language=None) -> str:
+    """
+    Render the body of an article page and store it in the cache.
+
+    :param article: The article, with its content, author, category and tags loaded.
+    :param language: The language to render in, the active one by default.
+    :return: The rendered HTML.
+    """
+    language = language or translation.get_language()
+    with translation.override(language):
+        html = render_to_string(ARTICLE_FRAGMENT_TEMPLATE, {'article': article})
+    cache.set(get_fragment_key(article.pk, article.last_modified, language), html, ARTICLE_FRAGMENT_TIMEOUT)
+    return html
+
+
+def get_article_fragment(article: Article) -> str:
+    """
+    Return the rendered body of an article in the active language.
+
+    Only ``pk`` and ``last_modified`` of the given article are used, the full
+    article is loaded from the database when the body is not cached yet.
+    """
+    language = translation.get_language()
+    html = cache.get(get_fragment_key(article.pk, article.last_modified, language))
+    if html is None:
+        html = render_article_fragment(load_article(article.pk), language)
+    return mark_safe(html)
+
+
+def fill_article_fragments(pk):
+    """
+    Render the body of an article in every language, e.g. after it was saved.
+    """
+    article = load_article(pk)
+    for language, _ in settings.LANGUAGES:
+        render_article_fragment(article, language)
+
+
+def invalidate_feed():
+    cache.delete_many([FEED_KEY.format(scheme=scheme) for scheme in ('http', 'https')])
@@ -18,3 +18,12 @@ class ArticleForm(forms.ModelForm):
     class Meta:
         model = Article
         fields = ['title', 'content', 'author', 'category', 'tags']
+
+
+class ArticleFilterForm(forms.Form):
+    """
+    The filters of the article list, ids taken from the query string.
+    """
+    category = forms.IntegerField(required=False, min_value=1)
+    tag = forms.IntegerField(required=False, min_value=1)
+    author = forms.IntegerField(required=False, min_value=1)
@@ -0,0 +1,15 @@
+from django.core.management import BaseCommand
+
+from blogapp.sitemap import build_sitemaps
+
+
+class Command(BaseCommand):
+    """
+    Pre-renders the sitemap shards
+    """
+    help = "Render the blog sitemap index and all of its shards into the cache"
+
+    def handle(self, *args, **options):
+        self.stdout.write("Build sitemaps")
+        count = build_sitemaps()
+        self.stdout.write(self.style.SUCCESS(f"Rendered {count} sitemap shards"))
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:40
+
+from django.db import migrations, models
+from django.db.models.functions import Substr
+
+
+def fill_excerpts(apps, schema_editor):
+    Article = apps.get_model('blogapp', 'Article')
+    # One statement, the contents are never loaded into Python
+    Article.objects.update(excerpt=Substr('content', 1, 200))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogapp', '0004_alter_article_pub_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=200, verbose_name='Excerpt'),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.4 on 2026-10-18 19:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogapp', '0005_article_excerpt'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['pub_date', 'id'], name='blogapp_art_pub_dat_68b4c6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['category', 'pub_date', 'id'], name='blogapp_art_categor_8184c6_idx'),
+        ),
+        # The automatic through table of Article.tags only has (article_id, tag_id) and tag_id alone,
+        # filtering by tag reads the article ids from this index without touching the table
+        migrations.RunSQL(
+            'CREATE INDEX blogapp_article_tags_tag_article_idx ON blogapp_article_tags (tag_id, article_id)',
+            'DROP INDEX blogapp_article_tags_tag_article_idx',
+        ),
+    ]
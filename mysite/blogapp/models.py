@@ -3,6 +3,9 @@ from django.db import models
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 
+# Length of the stored excerpt of the content, shown by the feed
+EXCERPT_LENGTH = 200
+
 
 class Author(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -29,12 +32,21 @@ class Tag(models.Model):
 class Article(models.Model):
     title = models.CharField(_("Title"), max_length=200)
     content = models.TextField(_("Content"))
+    # The start of the content, lists and feeds read it instead of the whole content
+    excerpt = models.CharField(_("Excerpt"), max_length=EXCERPT_LENGTH, blank=True, editable=False)
     pub_date = models.DateTimeField(_("Publication Date"), null=True, blank=True)
     last_modified = models.DateTimeField(_("Last Modified"), auto_now=True)
     author = models.ForeignKey('Author', verbose_name=_("Author"), on_delete=models.CASCADE)
     category = models.ForeignKey('Category', verbose_name=_("Category"), on_delete=models.CASCADE)
     tags = models.ManyToManyField('Tag', verbose_name=_("Tags"), blank=True)
 
+    def save(self, *args, **kwargs):
+        self.excerpt = self.content[:EXCERPT_LENGTH]
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'content' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'excerpt'}
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse('blogapp:article_details', kwargs={'pk': self.pk})
 
@@ -42,6 +54,11 @@ class Article(models.Model):
         verbose_name = _("Article")
         verbose_name_plural = _("Articles")
         ordering = ['-pub_date']
+        # Back the article list, newest first, for all articles and by category
+        indexes = [
+            models.Index(fields=['pub_date', 'id']),
+            models.Index(fields=['category', 'pub_date', 'id']),
+        ]
 
     def __str__(self):
         return self.title
@@ -0,0 +1,81 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import cache, sitemap
+from .models import Article, Category, Tag
+
+
+@receiver(post_save, sender=Article)
+def fill_saved_article_fragments(sender, instance: Article, raw=False, **kwargs):
+    """
+    Render the body of a saved article, so the next visitors get it from the cache.
+    """
+    if not raw:
+        cache.fill_article_fragments(instance.pk)
+
+
+@receiver(post_save, sender=Article)
+@receiver(post_delete, sender=Article)
+def invalidate_article_sitemap(sender, instance: Article, **kwargs):
+    """
+    Drop the cached sitemap shard of a saved or deleted article, after the commit.
+    """
+    # The instance loses its pk when it is deleted
+    pk = instance.pk
+    transaction.on_commit(lambda: sitemap.invalidate_article(pk))
+
+
+@receiver(post_save, sender=Article)
+@receiver(post_delete, sender=Article)
+def invalidate_latest_feed(sender, instance: Article, created=False, **kwargs):
+    """
+    Drop the cached feed when an article changes, a new draft is not in it.
+
+    Dropped after the commit, a request rendering the feed in between would
+    cache it again without the change.
+    """
+    if created and instance.pub_date is None:
+        return
+    transaction.on_commit(cache.invalidate_feed)
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def touch_articles_with_changed_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Give articles a new last_modified when their tags change, their cached bodies show the tags.
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            touch_articles(Article.objects.filter(pk=instance.pk))
+            cache.fill_article_fragments(instance.pk)
+        return
+    # tag.article_set was changed, pk_set holds article pks
+    if action == 'pre_clear':
+        instance._cleared_article_pks = list(instance.article_set.values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        pks = getattr(instance, '_cleared_article_pks', [])
+    elif action in ('post_add', 'post_remove'):
+        pks = list(pk_set)
+    else:
+        return
+    touch_articles(Article.objects.filter(pk__in=pks))
+
+
+@receiver(post_save, sender=Category)
+def touch_articles_of_saved_category(sender, instance: Category, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        touch_articles(Article.objects.filter(category=instance))
+
+
+@receiver(post_save, sender=Tag)
+def touch_articles_of_saved_tag(sender, instance: Tag, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        touch_articles(Article.objects.filter(tags=instance))
+
+
+def touch_articles(articles):
+    # QuerySet.update() skips auto_now, the old cached bodies are simply not looked up anymore
+    articles.update(last_modified=timezone.now())
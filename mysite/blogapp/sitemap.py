@@ -1,20 +1,110 @@
 from django.contrib.sitemaps import Sitemap
+from django.core.cache import cache
+from django.db.models import F, Max
+from django.template.loader import render_to_string
 from django.urls import reverse
 
-from .models import Article  # assuming BlogPost is the model you want to include in the sitemap
+from .models import Article
+
+# Articles per sitemap shard by primary key, the protocol allows up to 50000 URLs per sitemap
+SITEMAP_SHARD_SIZE = 10000
+
+# Rendered shards, a change of an article only drops the shard containing it
+SITEMAP_SHARD_KEY = 'blogapp:sitemap:shard:{shard}'
+
+# The shards having published articles, with their newest publication date
+SITEMAP_INDEX_KEY = 'blogapp:sitemap:index'
+
+# Cached shards are dropped after this time even if no article changed
+SITEMAP_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_shard(pk) -> int:
+    return (pk - 1) // SITEMAP_SHARD_SIZE
+
+
+def get_shard_range(shard) -> tuple:
+    return shard * SITEMAP_SHARD_SIZE + 1, (shard + 1) * SITEMAP_SHARD_SIZE
 
 
 class BlogSitemap(Sitemap):
+    """
+    The published articles, all of them or those of one shard (a range of primary keys).
+    """
     changefreq = 'never'
     priority = 0.5
+    # A shard always fits on the first page, the offset pagination of Sitemap is not used
+    limit = SITEMAP_SHARD_SIZE
+
+    def __init__(self, shard=None):
+        self.shard = shard
 
     def items(self):
-        # return all published blog posts
-        return Article.objects.filter(pub_date__isnull=False).order_by('-pub_date')
+        # Only what the URLs need, never the content
+        articles = Article.objects.filter(pub_date__isnull=False).only('pk', 'pub_date').order_by('pk')
+        if self.shard is not None:
+            articles = articles.filter(pk__range=get_shard_range(self.shard))
+        return articles
 
     def lastmod(self, obj: Article):
         return obj.pub_date
 
     def location(self, item: Article):
         # return the url for each article
-        return item.get_absolute_url()
\ No newline at end of file
+        return reverse('blogapp:article_details', kwargs={'pk': item.pk})
+
+
+def get_shard_index() -> list:
+    """
+    Return the shards having published articles as (shard, newest pub_date) pairs.
+    """
+    index = cache.get(SITEMAP_INDEX_KEY)
+    if index is None:
+        index = list(
+            Article.objects
+            .filter(pub_date__isnull=False)
+            .annotate(shard=(F('pk') - 1) / SITEMAP_SHARD_SIZE)
+            .values('shard')
+            .annotate(lastmod=Max('pub_date'))
+            .order_by('shard')
+            .values_list('shard', 'lastmod')
+        )
+        cache.set(SITEMAP_INDEX_KEY, index, SITEMAP_CACHE_TIMEOUT)
+    return index
+
+
+def render_shard(shard) -> str:
+    """
+    Render the sitemap XML of a shard and store it in the cache.
+    """
+    urls = BlogSitemap(shard).get_urls()
+    xml = render_to_string('sitemap.xml', {'urlset': urls})
+    cache.set(SITEMAP_SHARD_KEY.format(shard=shard), xml, SITEMAP_CACHE_TIMEOUT)
+    return xml
+
+
+def get_shard_xml(shard) -> str:
+    xml = cache.get(SITEMAP_SHARD_KEY.format(shard=shard))
+    if xml is None:
+        xml = render_shard(shard)
+    return xml
+
+
+def invalidate_article(pk):
+    """
+    Drop the cached shard of a changed article and the index.
+    """
+    cache.delete_many([SITEMAP_SHARD_KEY.format(shard=get_shard(pk)), SITEMAP_INDEX_KEY])
+
+
+def build_sitemaps() -> int:
+    """
+    Render the index and every shard into the cache, e.g. after a deployment.
+
+    :return: The number of shards.
+    """
+    cache.delete(SITEMAP_INDEX_KEY)
+    index = get_shard_index()
+    for shard, _ in index:
+        render_shard(shard)
+    return len(index)
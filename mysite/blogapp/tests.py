@@ -1,3 +1,203 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from blogapp.cache import get_fragment_key
+from blogapp.models import Article, Author, Category, Tag
+from blogapp.sitemap import SITEMAP_SHARD_KEY, get_shard
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ArticleFragmentCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='writer', password='qwerty')
+        cls.author = Author.objects.create(user=user, bio='Writes')
+        cls.category = Category.objects.create(name='News')
+
+    def setUp(self):
+        cache.clear()
+        self.article = Article.objects.create(
+            title='Hello', content='First words', pub_date=timezone.now(),
+            author=self.author, category=self.category,
+        )
+
+    def test_saved_article_is_served_without_loading_content(self):
+        self.assertIsNotNone(cache.get(get_fragment_key(self.article.pk, self.article.last_modified, 'en')))
+        url = reverse('blogapp:article_details', kwargs={'pk': self.article.pk})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_ACCEPT_LANGUAGE='en')
+        self.assertContains(response, 'First words')
+        self.assertFalse(any('"content"' in query['sql'] for query in queries.captured_queries))
+
+    def test_edits_and_tag_changes_are_visible_immediately(self):
+        url = reverse('blogapp:article_details', kwargs={'pk': self.article.pk})
+        self.client.get(url)
+        self.article.content = 'Second words'
+        self.article.save()
+        self.assertContains(self.client.get(url), 'Second words')
+
+        self.article.tags.add(Tag.objects.create(name='django'))
+        self.assertContains(self.client.get(url), 'django')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SitemapTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='mapper', password='qwerty')
+        author = Author.objects.create(user=user, bio='Maps')
+        category = Category.objects.create(name='Maps')
+        cls.articles = [
+            Article.objects.create(
+                title=f'Article {number}', content='x' * 1000, pub_date=timezone.now(),
+                author=author, category=category,
+            )
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_index_links_shards_rendered_without_content(self):
+        response = self.client.get(reverse('sitemap'))
+        shard = get_shard(self.articles[0].pk)
+        shard_url = reverse('sitemap-blog', kwargs={'shard': shard})
+        self.assertContains(response, shard_url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(shard_url)
+        for article in self.articles:
+            self.assertContains(response, article.get_absolute_url())
+        self.assertFalse(any('"content"' in query['sql'] for query in queries.captured_queries))
+        # Served from the cache now
+        with self.assertNumQueries(0):
+            self.client.get(shard_url)
+
+    def test_saving_an_article_drops_only_its_shard(self):
+        article = self.articles[0]
+        cache.set(SITEMAP_SHARD_KEY.format(shard=get_shard(article.pk)), 'cached')
+        cache.set(SITEMAP_SHARD_KEY.format(shard=get_shard(article.pk) + 1), 'cached')
+        article.title = 'Renamed'
+        with self.captureOnCommitCallbacks() as callbacks:
+            article.save()
+            # Readers still get the cached shard while the transaction is open
+            self.assertEqual(cache.get(SITEMAP_SHARD_KEY.format(shard=get_shard(article.pk))), 'cached')
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(cache.get(SITEMAP_SHARD_KEY.format(shard=get_shard(article.pk))))
+        self.assertEqual(cache.get(SITEMAP_SHARD_KEY.format(shard=get_shard(article.pk) + 1)), 'cached')
+        self.assertEqual(self.client.get(reverse('sitemap-blog', kwargs={'shard': 999})).status_code, 404)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class LatestArticlesFeedTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='feeder', password='qwerty')
+        cls.author = Author.objects.create(user=user, bio='Feeds')
+        cls.category = Category.objects.create(name='Feeds')
+
+    def setUp(self):
+        cache.clear()
+        self.article = Article.objects.create(
+            title='Fresh', content='a' * 150 + 'b' * 150, pub_date=timezone.now(),
+            author=self.author, category=self.category,
+        )
+
+    def test_feed_uses_the_stored_excerpt(self):
+        self.assertEqual(self.article.excerpt, 'a' * 150 + 'b' * 50)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('blogapp:articles_feed'))
+        self.assertContains(response, self.article.excerpt)
+        self.assertNotContains(response, 'b' * 51)
+        self.assertFalse(any('"content"' in query['sql'] for query in queries.captured_queries))
+
+    def test_cached_feed_answers_conditional_requests(self):
+        url = reverse('blogapp:articles_feed')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.article.title = 'Updated'
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.article.save()
+            # Readers still get the cached feed while the transaction is open
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        for callback in callbacks:
+            callback()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Updated')
+
+    def test_removed_article_moves_last_modified(self):
+        older = Article.objects.create(
+            title='Older', content='text', pub_date=timezone.now() - timedelta(days=1),
+            author=self.author, category=self.category,
+        )
+        url = reverse('blogapp:articles_feed')
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        # The newest article stays the same, the feed is generated again later
+        with mock.patch('time.time', return_value=time.time() + 5):
+            with self.captureOnCommitCallbacks(execute=True):
+                older.delete()
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Older')
+
+
+class ArticlesListViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='lister', password='qwerty')
+        author = Author.objects.create(user=user, bio='Lists')
+        cls.news, cls.other = Category.objects.create(name='News'), Category.objects.create(name='Other')
+        cls.tag = Tag.objects.create(name='python')
+        now = timezone.now()
+        cls.articles = Article.objects.bulk_create([
+            Article(
+                title=f'Article {number}', content='text', pub_date=now - timedelta(days=number),
+                author=author, category=cls.news if number % 2 else cls.other,
+            )
+            for number in range(25)
+        ])
+        for article in cls.articles[:3]:
+            article.tags.add(cls.tag)
+
+    def test_list_is_paginated_newest_first(self):
+        url = reverse('blogapp:articles')
+        # The count, the page with authors and categories, and the tags of the page
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['articles']), 20)
+        self.assertEqual(response.context['articles'][0].title, 'Article 0')
+        self.assertEqual(len(self.client.get(url, {'page': 2}).context['articles']), 5)
+
+    def test_list_is_filtered_by_category_tag_and_author(self):
+        url = reverse('blogapp:articles')
+        response = self.client.get(url, {'category': self.news.pk})
+        self.assertEqual(response.context['paginator'].count, 12)
+        self.assertEqual(response.context['filter_query'], f'category={self.news.pk}')
+        response = self.client.get(url, {'tag': self.tag.pk, 'author': self.articles[0].author_id})
+        self.assertEqual([article.title for article in response.context['articles']],
+                         ['Article 0', 'Article 1', 'Article 2'])
+
+    def test_invalid_filter_leaves_the_others_applied(self):
+        response = self.client.get(reverse('blogapp:articles'), {'category': self.news.pk, 'tag': 'python'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['paginator'].count, 12)
+        self.assertEqual(response.context['filter_query'], f'category={self.news.pk}')
@@ -1,17 +1,59 @@
+import hashlib
+import time
+
 from django.contrib.auth import get_user_model
 from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
 from django.views.generic import ListView, CreateView, DetailView, UpdateView, DeleteView
 from .models import Article, Author
 from django.urls import reverse_lazy, reverse
-from .forms import AuthorCreateForm, ArticleForm
+from .forms import AuthorCreateForm, ArticleForm, ArticleFilterForm
+from .cache import FEED_KEY, FEED_TIMEOUT, get_article_fragment
 
 
 class ArticlesListView(ListView):
+    """
+    The published articles, newest first, a page at a time.
+
+    ``?category=``, ``?tag=`` and ``?author=`` filter by id, backed by the
+    indexes on (pub_date, id), (category, pub_date, id) and the
+    (tag_id, article_id) index of the tags table. Invalid values are
+    ignored, the other filters still apply. The tags are prefetched for the
+    articles of the page only.
+    """
     model = Article
     template_name = 'blogapp/article_list.html'
     context_object_name = 'articles'
-    queryset = (Article.objects.select_related('author', 'category')
-                .prefetch_related('tags').defer('content').filter(pub_date__isnull=False))
+    paginate_by = 20
+    queryset = (Article.objects.select_related('author__user', 'category')
+                .prefetch_related('tags').defer('content').filter(pub_date__isnull=False)
+                .order_by('-pub_date', '-pk'))
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        self.filter_form = ArticleFilterForm(self.request.GET)
+        self.filter_form.is_valid()
+        # Only holds the fields which are valid
+        filters = self.filter_form.cleaned_data
+        if filters.get('category'):
+            queryset = queryset.filter(category_id=filters['category'])
+        if filters.get('tag'):
+            queryset = queryset.filter(tags__id=filters['tag'])
+        if filters.get('author'):
+            queryset = queryset.filter(author_id=filters['author'])
+        return queryset
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # The filters, kept by the page links
+        query = self.request.GET.copy()
+        for name in ['page', *self.filter_form.errors]:
+            query.pop(name, None)
+        context['filter_query'] = query.urlencode()
+        return context
 
 
 class ArticleCreateView(CreateView):
@@ -23,6 +65,13 @@ class ArticleCreateView(CreateView):
 class ArticleDetailView(DetailView):
     model = Article
     template_name = 'blogapp/article_details.html'
+    # The body comes from the fragment cache, the content is only loaded to render it
+    queryset = Article.objects.only('pk', 'title', 'last_modified')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['article_fragment'] = get_article_fragment(self.object)
+        return context
 
 
 class ArticleUpdateView(UpdateView):
@@ -60,18 +109,55 @@ class CreateUserView(CreateView):
 
 
 class LatestArticlesFeed(Feed):
+    """
+    The latest published articles as RSS.
+
+    The generated XML is cached until an article changes and conditional
+    requests are answered with 304 from the cached ETag and Last-Modified.
+    Last-Modified is the time the XML was generated, the newest article
+    would stay the same when another one leaves the feed.
+    """
     title = "Latest Articles"
     link = "blogapp:articles"
     description = "Updates on the latest articles"
 
+    def __call__(self, request, *args, **kwargs):
+        key = FEED_KEY.format(scheme=request.scheme)
+        feed = cache.get(key)
+        if feed is None:
+            response = super().__call__(request, *args, **kwargs)
+            feed = {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'etag': quote_etag(hashlib.md5(response.content, usedforsecurity=False).hexdigest()),
+                'last_modified': int(time.time()),
+            }
+            cache.set(key, feed, FEED_TIMEOUT)
+
+        not_modified = get_conditional_response(request, etag=feed['etag'], last_modified=feed['last_modified'])
+        response = not_modified or HttpResponse(feed['content'], content_type=feed['content_type'])
+        response['ETag'] = feed['etag']
+        response['Last-Modified'] = http_date(feed['last_modified'])
+        return response
+
     def items(self):
-        return Article.objects.filter(pub_date__isnull=False).order_by('-pub_date')[:5]
+        return (
+            Article.objects.filter(pub_date__isnull=False)
+            .only('pk', 'title', 'excerpt', 'pub_date', 'last_modified')
+            .order_by('-pub_date')[:5]
+        )
 
     def item_title(self, item: Article):
         return item.title
 
     def item_description(self, item: Article):
-        return item.content[:200]
+        return item.excerpt
+
+    def item_pubdate(self, item: Article):
+        return item.pub_date
+
+    def item_updateddate(self, item: Article):
+        return item.last_modified
 
     def item_link(self, item):
         return reverse('blogapp:article_details', args=[item.pk])
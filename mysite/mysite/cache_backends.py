@@ -0,0 +1,481 @@
+import itertools
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from hashlib import md5
+from timeit import default_timer
+
+from django.core.cache import caches
+from django.core.cache.backends import filebased, locmem, memcached, redis
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.files import locks
+
+from .middleware import current_metrics
+
+MISSING = object()
+
+
+class InstrumentedCacheMixin:
+    """
+    Adds the time and number of cache calls to the metrics of the current request.
+
+    Only the outermost call is measured, e.g. ``get_many`` of backends
+    implemented with ``get`` counts as one call. Outside of requests the
+    calls are not measured.
+    """
+
+    @contextmanager
+    def timed(self):
+        metrics = current_metrics.get()
+        if metrics is None or metrics.cache_depth:
+            yield None
+            return
+        metrics.cache_depth += 1
+        started = default_timer()
+        try:
+            yield metrics
+        finally:
+            metrics.cache_depth -= 1
+            metrics.cache_calls += 1
+            metrics.cache += default_timer() - started
+
+    def get(self, key, default=None, version=None):
+        with self.timed() as metrics:
+            value = super().get(key, MISSING, version)
+            if metrics is not None:
+                if value is MISSING:
+                    metrics.cache_misses += 1
+                else:
+                    metrics.cache_hits += 1
+        return default if value is MISSING else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        with self.timed() as metrics:
+            values = super().get_many(keys, version)
+            if metrics is not None:
+                metrics.cache_hits += len(values)
+                metrics.cache_misses += len(keys) - len(values)
+        return values
+
+    def set(self, *args, **kwargs):
+        with self.timed():
+            return super().set(*args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        with self.timed():
+            return super().add(*args, **kwargs)
+
+    def touch(self, *args, **kwargs):
+        with self.timed():
+            return super().touch(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with self.timed():
+            return super().delete(*args, **kwargs)
+
+    def has_key(self, *args, **kwargs):
+        with self.timed():
+            return super().has_key(*args, **kwargs)
+
+    def incr(self, *args, **kwargs):
+        with self.timed():
+            return super().incr(*args, **kwargs)
+
+    def decr(self, *args, **kwargs):
+        with self.timed():
+            return super().decr(*args, **kwargs)
+
+    def set_many(self, *args, **kwargs):
+        with self.timed():
+            return super().set_many(*args, **kwargs)
+
+    def delete_many(self, *args, **kwargs):
+        with self.timed():
+            return super().delete_many(*args, **kwargs)
+
+    def get_or_set(self, *args, **kwargs):
+        with self.timed():
+            return super().get_or_set(*args, **kwargs)
+
+    def clear(self):
+        with self.timed():
+            return super().clear()
+
+
+# Number of lock files of a FileBasedCache, keys share them by hash
+FILE_LOCK_STRIPES = 64
+
+
+class FileBasedCache(InstrumentedCacheMixin, filebased.FileBasedCache):
+    """
+    The file based cache, with ``add`` and ``incr`` atomic across the processes of one machine.
+
+    Django checks and writes the file in two steps, so two processes could
+    both add the same key or lose an increment. Here both hold an exclusive
+    lock on one of ``FILE_LOCK_STRIPES`` lock files while they do it.
+
+    Django also lists the whole cache directory on every write to check
+    ``MAX_ENTRIES``. Here the directory is only listed every ``CULL_EVERY``
+    writes of a cache instance (100 by default), so the cache can grow past
+    ``MAX_ENTRIES`` by that many entries per worker thread before it is culled.
+    """
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self.cull_every = max(int(params.get('OPTIONS', {}).get('CULL_EVERY', 100)), 1)
+        self.writes = itertools.count(1)
+
+    def _cull(self):
+        # Called by set() before every write
+        if next(self.writes) % self.cull_every == 0:
+            super()._cull()
+
+    @contextmanager
+    def key_lock(self, key, version):
+        directory = os.path.join(self._dir, 'locks')
+        os.makedirs(directory, exist_ok=True)
+        stripe = int(md5(self.make_and_validate_key(key, version).encode(), usedforsecurity=False).hexdigest(), 16)
+        with open(os.path.join(directory, f'{stripe % FILE_LOCK_STRIPES}.lock'), 'a') as file:
+            locks.lock(file, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(file)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self.key_lock(key, version):
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        with self.key_lock(key, version):
+            return super().incr(key, delta, version)
+
+    def decr(self, key, delta=1, version=None):
+        with self.key_lock(key, version):
+            return super().decr(key, delta, version)
+
+
+class LocMemCache(InstrumentedCacheMixin, locmem.LocMemCache):
+    pass
+
+
+class PyMemcacheCache(InstrumentedCacheMixin, memcached.PyMemcacheCache):
+    pass
+
+
+class RedisCache(InstrumentedCacheMixin, redis.RedisCache):
+    pass
+
+
+# In-process stores of the two-tier caches by shared cache alias, shared by all threads
+local_stores = {}
+local_stores_lock = threading.Lock()
+
+# Journal of changed keys in the shared cache, a sequence number and one entry per change
+JOURNAL_SEQUENCE_KEY = 'two-tier:journal'
+JOURNAL_ENTRY_KEY = 'two-tier:journal:{}'
+
+# Journal entry telling the other processes to drop their whole local tier
+CLEAR_ALL = '*'
+
+
+class LocalStore:
+    """
+    A bounded LRU of pickled values with their expiry time, and the position
+    of this process in the invalidation journal.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.last_seen = None
+        self.next_poll = 0.0
+        self.published = set()
+        # Keys changed by this process which are not in the journal yet
+        self.pending = set()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            expires, pickled = entry
+            if expires <= time.monotonic():
+                self.remove(key)
+                return MISSING
+            self.entries.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def set(self, key, value, timeout):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(pickled) > self.max_bytes:
+            self.delete(key)
+            return
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = (time.monotonic() + timeout, pickled)
+            self.size += len(pickled)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        # Callers hold the lock
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def delete(self, key):
+        with self.lock:
+            self.remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class BaseTwoTierCache(BaseCache):
+    """
+    A small in-process LRU with a short TTL in front of a shared cache.
+
+    ``LOCATION`` is the alias of the shared cache in ``CACHES``. Reads are
+    answered from the local tier for at most ``LOCAL_TIMEOUT`` seconds, the
+    local tier holds at most ``LOCAL_MAX_ENTRIES`` values and
+    ``LOCAL_MAX_BYTES`` of pickled data, least recently used values are
+    evicted first.
+
+    Writes go to the shared cache and are announced in a journal kept in the
+    shared cache, with one entry for all keys a request changed when Django
+    closes the caches at the end of the request, or when ``JOURNAL_BATCH_SIZE``
+    keys are waiting. Every process reads the journal at most every
+    ``JOURNAL_POLL_INTERVAL`` seconds and drops the changed keys from its local
+    tier, or the whole tier when it missed entries. Keys starting with one of
+    ``LOCAL_EXCLUDE_PREFIXES`` skip the local tier and the journal, e.g.
+    counters written on every request or values which must never be stale.
+
+    The shared cache must implement ``add`` and ``incr`` atomically across
+    processes, the journal and locks like the one of ``cache_page_swr`` rely
+    on it. Use Redis or Memcached in production, the ``FileBasedCache`` of
+    this module only covers the processes of one machine.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = location
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self.poll_interval = options.get('JOURNAL_POLL_INTERVAL', 1)
+        self.journal_timeout = options.get('JOURNAL_TIMEOUT', 300)
+        self.journal_max_entries = options.get('JOURNAL_MAX_ENTRIES', 1000)
+        self.journal_batch_size = options.get('JOURNAL_BATCH_SIZE', 100)
+        self.exclude_prefixes = tuple(options.get('LOCAL_EXCLUDE_PREFIXES', ()))
+        with local_stores_lock:
+            if location not in local_stores:
+                local_stores[location] = LocalStore(
+                    max_entries=options.get('LOCAL_MAX_ENTRIES', 1000),
+                    max_bytes=options.get('LOCAL_MAX_BYTES', 16 * 1024 * 1024),
+                )
+            self.store = local_stores[location]
+
+    @property
+    def shared(self):
+        # Looked up on every use, some backends keep one client per thread
+        return caches[self.shared_alias]
+
+    def is_local(self, key):
+        return not key.startswith(self.exclude_prefixes)
+
+    def local_timeout_for(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self.local_timeout
+        return min(self.local_timeout, timeout)
+
+    def poll(self):
+        """
+        Drop the local values changed by other processes since the last poll.
+        """
+        store = self.store
+        now = time.monotonic()
+        if now < store.next_poll:
+            return
+        store.next_poll = now + self.poll_interval
+        # Processes outside of requests publish their changes as often as they poll
+        self.flush_journal()
+        sequence = self.shared.get(JOURNAL_SEQUENCE_KEY, 0)
+        last_seen, store.last_seen = store.last_seen, sequence
+        if last_seen is None or sequence == last_seen:
+            return
+        if sequence < last_seen or sequence - last_seen > self.journal_max_entries:
+            # The journal was lost or this process fell too far behind
+            store.clear()
+            return
+        numbers = [number for number in range(last_seen + 1, sequence + 1) if number not in store.published]
+        entries = self.shared.get_many([JOURNAL_ENTRY_KEY.format(number) for number in numbers])
+        if len(entries) < len(numbers) or CLEAR_ALL in entries.values():
+            store.clear()
+            return
+        for keys in entries.values():
+            for key in keys:
+                store.delete(key)
+
+    def publish(self, keys):
+        """
+        Announce changed keys (or ``CLEAR_ALL``) to the other processes.
+        """
+        shared = self.shared
+        try:
+            sequence = shared.incr(JOURNAL_SEQUENCE_KEY)
+        except ValueError:
+            shared.add(JOURNAL_SEQUENCE_KEY, 0, None)
+            sequence = shared.incr(JOURNAL_SEQUENCE_KEY)
+        shared.set(JOURNAL_ENTRY_KEY.format(sequence), keys, self.journal_timeout)
+        # Our own changes are already applied to the local tier
+        self.store.published.add(sequence)
+        if len(self.store.published) > self.journal_max_entries:
+            self.store.published = {number for number in self.store.published if number > sequence - self.journal_max_entries}
+
+    def queue_journal(self, keys):
+        store = self.store
+        with store.lock:
+            store.pending.update(keys)
+            due = len(store.pending) >= self.journal_batch_size
+        if due:
+            self.flush_journal()
+
+    def flush_journal(self):
+        """
+        Publish the keys changed since the last flush as one journal entry.
+        """
+        store = self.store
+        with store.lock:
+            keys, store.pending = store.pending, set()
+        if keys:
+            self.publish(sorted(keys))
+
+    def close(self, **kwargs):
+        # Called by Django at the end of every request
+        self.flush_journal()
+
+    def get(self, key, default=None, version=None):
+        if not self.is_local(key):
+            return self.shared.get(key, default, version)
+        local_key = self.make_and_validate_key(key, version)
+        self.poll()
+        value = self.store.get(local_key)
+        if value is MISSING:
+            value = self.shared.get(key, MISSING, version)
+            if value is MISSING:
+                return default
+            self.store.set(local_key, value, self.local_timeout)
+        return value
+
+    def get_many(self, keys, version=None):
+        self.poll()
+        found = {}
+        missing = []
+        for key in keys:
+            value = MISSING
+            if self.is_local(key):
+                value = self.store.get(self.make_and_validate_key(key, version))
+            if value is MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            fetched = self.shared.get_many(missing, version)
+            for key, value in fetched.items():
+                if self.is_local(key):
+                    self.store.set(self.make_and_validate_key(key, version), value, self.local_timeout)
+            found.update(fetched)
+        return found
+
+    def has_key(self, key, version=None):
+        if self.is_local(key):
+            self.poll()
+            if self.store.get(self.make_and_validate_key(key, version)) is not MISSING:
+                return True
+        return self.shared.has_key(key, version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version)
+        self.changed(key, version, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version)
+        if added:
+            self.changed(key, version, value, timeout)
+        return added
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version)
+        keys = []
+        for key, value in data.items():
+            if key not in failed and self.is_local(key):
+                local_key = self.make_and_validate_key(key, version)
+                self.store_local(local_key, value, timeout)
+                keys.append(local_key)
+        self.queue_journal(keys)
+        return failed
+
+    def changed(self, key, version, value=MISSING, timeout=DEFAULT_TIMEOUT):
+        if not self.is_local(key):
+            return
+        local_key = self.make_and_validate_key(key, version)
+        if value is MISSING:
+            self.store.delete(local_key)
+        else:
+            self.store_local(local_key, value, timeout)
+        self.queue_journal([local_key])
+
+    def store_local(self, local_key, value, timeout):
+        if timeout is not DEFAULT_TIMEOUT and timeout is not None and timeout <= 0:
+            self.store.delete(local_key)
+        else:
+            self.store.set(local_key, value, self.local_timeout_for(timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        touched = self.shared.touch(key, timeout, version)
+        if self.is_local(key):
+            self.store.delete(self.make_and_validate_key(key, version))
+        return touched
+
+    def delete(self, key, version=None):
+        deleted = self.shared.delete(key, version)
+        self.changed(key, version)
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.shared.delete_many(keys, version)
+        local_keys = [self.make_and_validate_key(key, version) for key in keys if self.is_local(key)]
+        for local_key in local_keys:
+            self.store.delete(local_key)
+        self.queue_journal(local_keys)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version)
+        self.changed(key, version, value)
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        value = self.shared.decr(key, delta, version)
+        self.changed(key, version, value)
+        return value
+
+    def clear(self):
+        self.shared.clear()
+        with self.store.lock:
+            self.store.pending.clear()
+        self.store.clear()
+        self.publish(CLEAR_ALL)
+
+
+class TwoTierCache(InstrumentedCacheMixin, BaseTwoTierCache):
+    pass
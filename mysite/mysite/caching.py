@@ -0,0 +1,160 @@
+import time
+from functools import wraps
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import cc_delim_re, get_cache_key, learn_cache_key, patch_response_headers
+
+# Expired responses are still served for this long while one request renders a fresh one
+STALE_TIMEOUT = 60
+
+# A request rendering a response holds the lock at most this long, e.g. when its worker dies
+LOCK_TIMEOUT = 30
+
+# Requests finding no response wait this long for the request rendering it, then render it themselves
+WAIT_TIMEOUT = 5
+WAIT_INTERVAL = 0.05
+
+# Locks have a prefix of their own, so a two-tier cache can keep them out of its local tier
+LOCK_KEY = 'cache-page-swr:lock:{}'
+
+# Results of a lookup, passed to on_lookup
+HIT = 'hit'
+STALE = 'stale'
+MISS = 'miss'
+
+
+def is_cacheable(response) -> bool:
+    # Like UpdateCacheMiddleware, without responses setting cookies or marked private
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return False
+    directives = {directive.strip().lower() for directive in cc_delim_re.split(response.get('Cache-Control', ''))}
+    return not directives & {'private', 'no-cache', 'no-store'}
+
+
+def get_lock_key(key) -> str:
+    return LOCK_KEY.format(md5(key.encode(), usedforsecurity=False).hexdigest())
+
+
+def cache_page_swr(timeout, *, stale_timeout=STALE_TIMEOUT, cache=None, key_prefix=None, key_func=None,
+                   on_lookup=None, patch_headers=True, wait_timeout=WAIT_TIMEOUT):
+    """
+    Cache GET responses of a view like ``cache_page``, with stampede protection.
+
+    When a response expires, the first request renders a fresh one while the
+    others keep getting the expired response for up to ``stale_timeout``
+    seconds. When there is no response at all, one request renders it and
+    the others wait up to ``wait_timeout`` seconds for it, or take over when
+    it finishes without storing one. Only one request renders a response at
+    a time, guarded by a lock in the cache, per URL until the first response
+    taught which headers vary.
+
+    Use with ``method_decorator`` on class based views, as ``cache_page``.
+
+    :param timeout: Seconds a response is fresh.
+    :param stale_timeout: Seconds an expired response is still served while it is renewed.
+    :param cache: The cache alias, ``CACHE_MIDDLEWARE_ALIAS`` by default.
+    :param key_prefix: The key prefix, ``CACHE_MIDDLEWARE_KEY_PREFIX`` by default.
+    :param key_func: Returns the cache key of a request, replaces the keys
+        built from the URL and the ``Vary`` headers like ``cache_page`` does.
+    :param on_lookup: Called with ``HIT``, ``STALE`` or ``MISS`` for every lookup.
+    :param patch_headers: Set ``Expires`` and ``Cache-Control: max-age`` like ``cache_page``.
+    :param wait_timeout: Seconds to wait for a response rendered by another request.
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+
+            response_cache = caches[cache or settings.CACHE_MIDDLEWARE_ALIAS]
+            prefix = settings.CACHE_MIDDLEWARE_KEY_PREFIX if key_prefix is None else key_prefix
+
+            def lookup():
+                if key_func is not None:
+                    return key_func(request)
+                # None until the first response taught which headers vary
+                return get_cache_key(request, prefix, 'GET', cache=response_cache)
+
+            key = lookup()
+            entry = response_cache.get(key) if key is not None else None
+            if entry is not None and entry['fresh_until'] > time.time():
+                report(HIT)
+                return entry['response']
+
+            lock_key = get_lock_key(key if key is not None else f'{prefix}:{request.build_absolute_uri()}')
+            locked = response_cache.add(lock_key, 1, LOCK_TIMEOUT)
+            if not locked:
+                if entry is not None:
+                    # Another request is renewing it
+                    report(STALE)
+                    return entry['response']
+                entry, locked = wait_for(response_cache, lookup, lock_key, wait_timeout)
+                if entry is not None:
+                    report(HIT)
+                    return entry['response']
+                # The other request stored nothing or takes too long, render it
+            report(MISS)
+
+            try:
+                response = view_func(request, *args, **kwargs)
+            except BaseException:
+                release(response_cache, lock_key, locked)
+                raise
+            if not is_cacheable(response):
+                release(response_cache, lock_key, locked)
+                return response
+            if patch_headers:
+                patch_response_headers(response, timeout)
+
+            def store(rendered):
+                store_key = key
+                if key_func is None:
+                    learn_cache_key(request, rendered, timeout + stale_timeout, prefix, cache=response_cache)
+                    # learn_cache_key() returns the key of request.method, HEAD requests are looked up as GET too
+                    store_key = get_cache_key(request, prefix, 'GET', cache=response_cache)
+                response_cache.set(
+                    store_key, {'response': rendered, 'fresh_until': time.time() + timeout}, timeout + stale_timeout,
+                )
+                release(response_cache, lock_key, locked)
+
+            if hasattr(response, 'render') and callable(response.render):
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+            return response
+
+        def report(result):
+            if on_lookup is not None:
+                on_lookup(result)
+
+        return wrapper
+
+    return decorator
+
+
+def wait_for(response_cache, lookup, lock_key, timeout):
+    """
+    Wait for the response rendered by the request holding the lock.
+
+    :return: The entry once it is stored and False, or None and True when the
+        lock was released without a response and this request holds it now,
+        or None and False when the time is up.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        key = lookup()
+        entry = response_cache.get(key) if key is not None else None
+        if entry is not None:
+            return entry, False
+        if response_cache.add(lock_key, 1, LOCK_TIMEOUT):
+            return None, True
+    return None, False
+
+
+def release(response_cache, lock_key, locked):
+    if locked:
+        response_cache.delete(lock_key)
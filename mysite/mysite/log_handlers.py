@@ -0,0 +1,208 @@
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+from datetime import datetime, timezone
+
+from .metrics import LOG_RECORDS_DROPPED
+from .middleware import current_metrics
+
+# Records waiting for the listener, when the queue is full new records are dropped instead of blocking,
+# counted by the log_records_dropped_total metric
+QUEUE_SIZE = 10000
+
+# The listener writes at most this many records before flushing the streams
+BATCH_SIZE = 500
+
+# Attributes of every LogRecord, anything else was passed with extra= and is added to the JSON
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line, as ingested by Loki.
+
+    The request id and route of the current request are always included,
+    the duration when the record has the timing of a request.
+    """
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.thread,
+            'request_id': getattr(record, 'request_id', None),
+            'route': getattr(record, 'route', None),
+        }
+        timing = getattr(record, 'timing', None)
+        if timing:
+            data['duration_ms'] = timing.get('total_ms')
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and key not in data:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(data, default=str)
+
+
+class BatchEmitMixin:
+    """
+    Lets a stream handler write a batch of records with a single flush.
+    """
+
+    def emit_batch(self, records):
+        self.acquire()
+        try:
+            for record in records:
+                if not self.filter(record):
+                    continue
+                try:
+                    if getattr(self, 'shouldRollover', None) and self.shouldRollover(record):
+                        self.doRollover()
+                    if self.stream is None:
+                        self.stream = self._open()
+                    self.stream.write(self.format(record) + self.terminator)
+                except Exception:
+                    self.handleError(record)
+            if self.stream is not None:
+                self.stream.flush()
+        finally:
+            self.release()
+
+
+class StreamHandler(BatchEmitMixin, logging.StreamHandler):
+    pass
+
+
+def gzip_rotator(source, dest):
+    with open(source, 'rb') as file, gzip.open(dest, 'wb') as compressed:
+        shutil.copyfileobj(file, compressed)
+    os.remove(source)
+
+
+class GzipRotatingFileHandler(BatchEmitMixin, logging.handlers.RotatingFileHandler):
+    """
+    A ``RotatingFileHandler`` compressing the rotated files, e.g. ``logfile.log.1.gz``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.namer = lambda name: f'{name}.gz'
+        self.rotator = gzip_rotator
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """
+    A ``QueueListener`` passing everything already queued to the handlers at once.
+    """
+
+    def __init__(self, queue, *handlers, batch_size=BATCH_SIZE):
+        super().__init__(queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+
+    def handle_batch(self, records):
+        for handler in self.handlers:
+            accepted = [record for record in records if record.levelno >= handler.level]
+            if not accepted:
+                continue
+            if hasattr(handler, 'emit_batch'):
+                handler.emit_batch(accepted)
+            else:
+                for record in accepted:
+                    handler.handle(record)
+
+    def _monitor(self):
+        has_task_done = hasattr(self.queue, 'task_done')
+        stopped = False
+        while not stopped:
+            batch = []
+            record = self.dequeue(True)
+            while True:
+                if has_task_done:
+                    self.queue.task_done()
+                if record is self._sentinel:
+                    stopped = True
+                    break
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self.dequeue(False)
+                except queue.Empty:
+                    break
+            if batch:
+                self.handle_batch(batch)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on a queue and returns, a background thread writes them.
+
+    Configure it with the handlers doing the writing, e.g. in ``LOGGING``::
+
+        'queue': {
+            '()': 'mysite.log_handlers.QueueHandler',
+            'handlers': ['cfg://handlers.console', 'cfg://handlers.logfile'],
+        }
+
+    The target handlers have to be named so they sort before the queue handler,
+    ``dictConfig`` creates handlers in alphabetical order.
+    """
+
+    def __init__(self, handlers, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE):
+        super().__init__(queue.Queue(queue_size))
+        # dictConfig only resolves cfg:// references on item access
+        self.targets = [handlers[index] for index in range(len(handlers))]
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.start()
+
+    def start(self):
+        self.pid = os.getpid()
+        self.listener = BatchingQueueListener(self.queue, *self.targets, batch_size=self.batch_size)
+        self.listener.start()
+
+    def prepare(self, record):
+        # Runs in the logging thread, where the request context is known
+        metrics = current_metrics.get()
+        if metrics is not None:
+            if getattr(record, 'request_id', None) is None:
+                record.request_id = metrics.request_id
+            if getattr(record, 'route', None) is None:
+                record.route = metrics.route
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        # The record is copied to another thread, arguments and tracebacks are resolved now
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.pid != os.getpid():
+            # The listener thread does not survive a fork
+            self.queue = queue.Queue(self.queue.maxsize)
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+    def close(self):
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+        super().close()
@@ -0,0 +1,275 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in [*zip(names, values), *extra]]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def label_values(self, labels) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self.registry.changing() as values:
+            series = values.setdefault(self.name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def render(self, series):
+        for key, value in sorted(series.items()):
+            yield f'{self.name}{format_labels(self.labelnames, key)} {format_value(value)}'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames, buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.label_values(labels)
+        with self.registry.changing() as values:
+            series = values.setdefault(self.name, {})
+            # Counts per bucket (not cumulative), then the sum and the number of observations
+            state = series.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0, 0])
+            for index, upper in enumerate(self.buckets):
+                if value <= upper:
+                    break
+            else:
+                index = len(self.buckets)
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self, series):
+        for key, state in sorted(series.items()):
+            cumulative = 0
+            bounds = [*map(repr, self.buckets), '+Inf']
+            for upper, count in zip(bounds, state):
+                cumulative += count
+                labels = format_labels(self.labelnames, key, [('le', upper)])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {format_value(state[-2])}'
+            yield f'{self.name}_count{labels} {state[-1]}'
+
+
+class Registry:
+    """
+    Counters and histograms shared by all worker processes.
+
+    Every process keeps its own cumulative values and writes them to a JSON
+    file of its own in ``METRICS_DIR``, at most every ``METRICS_FLUSH_INTERVAL``
+    seconds and when it exits. A scrape sums the files of all processes, the
+    same way the Prometheus client does in multiprocess mode. Clear the
+    directory when the application is deployed. Without ``METRICS_DIR`` only
+    the values of the scraped process are exposed.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.values = {}
+        self.pid = None
+        self.filename = None
+        self.last_flush = 0.0
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def get_directory(self):
+        return getattr(settings, 'METRICS_DIR', None)
+
+    def check_process(self):
+        # A forked worker starts with a copy of the parent's values, which the parent already reports
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.filename = f'{self.pid}-{uuid.uuid4().hex[:8]}.json'
+            self.values = {}
+            self.last_flush = time.monotonic()
+
+    @contextmanager
+    def changing(self):
+        # Yields the values of this process to change them under the lock
+        with self.lock:
+            self.check_process()
+            yield self.values
+            due = time.monotonic() - self.last_flush >= getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+        if due:
+            self.flush()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            self.check_process()
+            return {
+                name: {key: list(value) if isinstance(value, list) else value for key, value in series.items()}
+                for name, series in self.values.items()
+            }
+
+    def flush(self):
+        """
+        Write the values of this process to its file in ``METRICS_DIR``.
+        """
+        directory = self.get_directory()
+        self.last_flush = time.monotonic()
+        if not directory:
+            return
+        values = self.snapshot()
+        data = {name: [[list(key), value] for key, value in series.items()] for name, series in values.items()}
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.filename)
+        temporary = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(data, file)
+        os.replace(temporary, path)
+
+    def collect(self) -> dict:
+        """
+        Return the values of all processes, summed per series.
+        """
+        directory = self.get_directory()
+        if not directory:
+            return self.snapshot()
+        self.flush()
+        merged = {}
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            try:
+                with open(path) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for name, series in data.items():
+                target = merged.setdefault(name, {})
+                for key, value in series:
+                    key = tuple(key)
+                    if key not in target:
+                        target[key] = value
+                    elif isinstance(value, list):
+                        target[key] = [old + new for old, new in zip(target[key], value)]
+                    else:
+                        target[key] += value
+        return merged
+
+    def render(self) -> str:
+        """
+        Return all metrics in the Prometheus text exposition format.
+        """
+        values = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            lines.extend(metric.render(values.get(name, {})))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+REQUEST_DURATION = registry.histogram(
+    'http_request_duration_seconds', 'Request latency by URL name, method and status.',
+    ['route', 'method', 'status'],
+)
+DB_QUERIES = registry.counter('db_queries_total', 'Database queries by URL name.', ['route'])
+DB_QUERY_DURATION = registry.counter(
+    'db_query_duration_seconds_total', 'Time spent in database queries by URL name.', ['route'],
+)
+DB_CONNECTIONS = registry.counter(
+    'db_connections_opened_total', 'Database connections opened by alias.', ['alias', 'vendor'],
+)
+CACHE_REQUESTS = registry.counter(
+    'cache_requests_total', 'Cache lookups by URL name and result (hit or miss).', ['route', 'result'],
+)
+LOG_RECORDS_DROPPED = registry.counter(
+    'log_records_dropped_total', 'Log records dropped because the queue of the log writer was full.',
+)
+CSV_ROWS = registry.counter(
+    'csv_rows_total', 'Rows of product CSV imports and exports by operation and result.', ['operation', 'result'],
+)
+CATALOG_CACHE_LOOKUPS = registry.counter(
+    'catalog_cache_lookups_total', 'Lookups of cached catalog responses by result (hit, stale or miss).', ['result'],
+)
+
+
+def observe_request(route, method, status, metrics):
+    """
+    Record the metrics of a finished request, see ``RequestTimingMiddleware``.
+    """
+    REQUEST_DURATION.observe(metrics.total, route=route, method=method, status=status)
+    if metrics.queries:
+        DB_QUERIES.inc(metrics.queries, route=route)
+        DB_QUERY_DURATION.inc(metrics.db, route=route)
+    if metrics.cache_hits:
+        CACHE_REQUESTS.inc(metrics.cache_hits, route=route, result='hit')
+    if metrics.cache_misses:
+        CACHE_REQUESTS.inc(metrics.cache_misses, route=route, result='miss')
+
+
+def count_connection(sender, connection, **kwargs):
+    DB_CONNECTIONS.inc(alias=connection.alias, vendor=connection.vendor)
+
+
+connection_created.connect(count_connection, dispatch_uid='mysite.metrics.count_connection')
+
+
+def metrics_view(request):
+    """
+    Expose the metrics of all worker processes in the Prometheus text format.
+
+    Scrapers send ``METRICS_TOKEN`` as a bearer token. Without a token the
+    metrics are only shown to staff users, or to everyone with ``DEBUG``.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        allowed = constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        allowed = settings.DEBUG or request.user.is_staff
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,199 @@
+import logging
+import re
+import uuid
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from timeit import default_timer
+
+from django.conf import settings
+from django.db import connections
+
+from .metrics import observe_request
+from .sampling import report_request
+
+log = logging.getLogger(__name__)
+
+# Metrics of the request handled by the current thread or task, None outside of requests
+current_metrics = ContextVar('current_metrics', default=None)
+
+# Incoming request ids are only reused when they look like this, anything else gets a new id
+REQUEST_ID_PATTERN = re.compile(r'^[\w.-]{1,64}$')
+
+
+class RequestMetrics:
+    """
+    Durations (in seconds) and counters collected while handling one request.
+    """
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.route = None
+        self.started = default_timer()
+        self.queries = 0
+        self.db = 0.0
+        self.cache_calls = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache = 0.0
+        self.cache_depth = 0
+        self.template = 0.0
+        self.template_depth = 0
+        self.total = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Used as a database execute wrapper
+        started = default_timer()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db += default_timer() - started
+
+    def as_dict(self) -> dict:
+        return {
+            'request_id': self.request_id,
+            'total_ms': round(self.total * 1000, 2),
+            'db_ms': round(self.db * 1000, 2),
+            'queries': self.queries,
+            'cache_ms': round(self.cache * 1000, 2),
+            'cache_calls': self.cache_calls,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'template_ms': round(self.template * 1000, 2),
+        }
+
+    def server_timing(self) -> str:
+        return ', '.join([
+            f'db;dur={self.db * 1000:.2f};desc="{self.queries} queries"',
+            f'cache;dur={self.cache * 1000:.2f};desc="{self.cache_calls} calls"',
+            f'tpl;dur={self.template * 1000:.2f}',
+            f'total;dur={self.total * 1000:.2f}',
+        ])
+
+
+@contextmanager
+def timed_template():
+    """
+    Add the time spent in the block to the template time of the current request.
+
+    Only the outermost rendering is measured, templates rendered by other
+    templates are part of it.
+    """
+    metrics = current_metrics.get()
+    if metrics is None or metrics.template_depth:
+        yield
+        return
+    metrics.template_depth += 1
+    started = default_timer()
+    try:
+        yield
+    finally:
+        metrics.template_depth -= 1
+        metrics.template += default_timer() - started
+
+
+def get_request_id(request) -> str:
+    request_id = request.headers.get('X-Request-ID', '')
+    if REQUEST_ID_PATTERN.match(request_id):
+        return request_id
+    return uuid.uuid4().hex
+
+
+def get_route(request) -> str:
+    # The namespaced URL name, e.g. shopapp:products-list
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '-'
+    return match.view_name
+
+
+class RequestTimingMiddleware:
+    """
+    Measure the database, cache, template and total time of every request.
+
+    The queries of all database connections are counted with an execute
+    wrapper, cache calls are timed by the backends in ``mysite.cache_backends``
+    and templates by the backend in ``mysite.template_backends``, wherever
+    they are rendered. The results are sent in a ``Server-Timing`` header,
+    logged as one structured line per request and compared with the
+    ``QUERY_BUDGETS`` setting, a dict mapping URL names (``'*'`` for all
+    other routes) to the maximum number of queries.
+
+    The body of a streaming response is produced after the headers are sent,
+    so its ``Server-Timing`` only covers the time until the response started.
+    The log line and the metrics are written once the body is consumed and
+    include the queries run while streaming, except for async streaming
+    responses, which are logged right away.
+
+    Put it first in ``MIDDLEWARE``, so the total includes the other middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics(get_request_id(request))
+        request.request_id = metrics.request_id
+        request.metrics = metrics
+        response = self.measure(metrics, self.get_response, request)
+        metrics.total = default_timer() - metrics.started
+
+        if getattr(settings, 'SERVER_TIMING_HEADER', True):
+            response['Server-Timing'] = metrics.server_timing()
+        response['X-Request-ID'] = metrics.request_id
+        if response.streaming and not response.is_async:
+            response.streaming_content = self.measure_stream(request, response, response.streaming_content, metrics)
+        else:
+            self.log_request(request, response, metrics)
+        return response
+
+    def measure(self, metrics, func, *args):
+        # Calls func with the queries and the cache and template calls counted in metrics
+        token = current_metrics.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(metrics))
+                return func(*args)
+        finally:
+            current_metrics.reset(token)
+
+    def measure_stream(self, request, response, chunks, metrics):
+        try:
+            while True:
+                chunk = self.measure(metrics, next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            metrics.total = default_timer() - metrics.started
+            self.log_request(request, response, metrics)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Lets log records emitted by the view carry the route
+        request.metrics.route = get_route(request)
+
+    def log_request(self, request, response, metrics):
+        route = get_route(request)
+        timing = metrics.as_dict()
+        timing.update({
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': response.status_code,
+        })
+        log.info(
+            ' '.join(f'{key}={value}' for key, value in timing.items()),
+            extra={'timing': timing, 'request_id': metrics.request_id, 'route': route},
+        )
+        observe_request(route, request.method, response.status_code, metrics)
+        report_request(route, metrics.total, response.status_code)
+
+        budgets = getattr(settings, 'QUERY_BUDGETS', {})
+        budget = budgets.get(route, budgets.get('*'))
+        if budget is not None and metrics.queries > budget:
+            log.warning(
+                "Query budget exceeded: %s ran %d queries, the budget is %d (request_id=%s)",
+                route, metrics.queries, budget, metrics.request_id,
+                extra={'request_id': metrics.request_id, 'route': route},
+            )
@@ -0,0 +1,145 @@
+"""
+Sentry trace sampling by route.
+
+Rates are read from the environment:
+
+- ``SENTRY_TRACES_SAMPLE_RATE``: rate of routes without an own rate (default 0.05)
+- ``SENTRY_ROUTE_SAMPLE_RATES``: own rates by URL name, e.g.
+  ``shopapp:products_list=0.01,shopapp:order_create=1``
+- ``SENTRY_PROFILES_SAMPLE_RATE``: share of the sampled transactions that are profiled (default 0.1)
+- ``SENTRY_SLOW_REQUEST_SECONDS``: requests taking longer count as slow (default 1.0)
+- ``SENTRY_BOOST_SECONDS``: how long a route stays boosted (default 300)
+- ``SENTRY_BOOST_SAMPLE_RATE``: rate of boosted routes (default 1.0)
+
+Whether a request is slow or fails is only known when it ends, while the
+sampling decision is taken when it starts. So a slow or failing request
+boosts the rate of its route for the next ``SENTRY_BOOST_SECONDS``, the
+following requests of a route in trouble are traced.
+"""
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+
+from django.urls import Resolver404, resolve
+
+log = logging.getLogger(__name__)
+
+# Rates of routes without an entry in SENTRY_ROUTE_SAMPLE_RATES
+DEFAULT_ROUTE_RATES = {
+    # Writes and imports are rare and worth tracing
+    'shopapp:order_create': 1.0,
+    'shopapp:orders-bulk-create': 1.0,
+    'shopapp:products-upload-csv': 1.0,
+    # Listings and static-ish pages are hit all the time
+    'shopapp:index': 0.01,
+    'shopapp:products_list': 0.01,
+    'shopapp:products-list': 0.01,
+    'shopapp:product-imports-detail': 0.01,
+    'blogapp:articles': 0.01,
+    'blogapp:articles_feed': 0.0,
+    'sitemap': 0.0,
+    'sitemap-blog': 0.0,
+    'metrics': 0.0,
+}
+
+# Requests for static and media files are never traced
+IGNORED_PATH_PREFIXES = ('/static/', '/media/', '/__debug__/')
+
+
+def env_float(name, default) -> float:
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        log.warning("Ignoring %s=%r, it is not a number", name, value)
+        return default
+
+
+def parse_rates(value) -> dict:
+    """
+    Parse ``name=rate`` pairs separated by commas.
+    """
+    rates = {}
+    for pair in filter(None, (part.strip() for part in value.split(','))):
+        name, _, rate = pair.rpartition('=')
+        try:
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            log.warning("Ignoring the sample rate %r, it is not a number", pair)
+    return rates
+
+
+TRACES_SAMPLE_RATE = env_float('SENTRY_TRACES_SAMPLE_RATE', 0.05)
+PROFILES_SAMPLE_RATE = env_float('SENTRY_PROFILES_SAMPLE_RATE', 0.1)
+SLOW_REQUEST_SECONDS = env_float('SENTRY_SLOW_REQUEST_SECONDS', 1.0)
+BOOST_SECONDS = env_float('SENTRY_BOOST_SECONDS', 300)
+BOOST_SAMPLE_RATE = env_float('SENTRY_BOOST_SAMPLE_RATE', 1.0)
+ROUTE_RATES = {**DEFAULT_ROUTE_RATES, **parse_rates(os.environ.get('SENTRY_ROUTE_SAMPLE_RATES', ''))}
+
+# Route name -> monotonic time until which the route is boosted
+boosted_until = {}
+boost_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1024)
+def resolve_route(path):
+    try:
+        return resolve(path).view_name
+    except Resolver404:
+        return None
+
+
+def get_path(sampling_context):
+    environ = sampling_context.get('wsgi_environ')
+    if environ is not None:
+        return environ.get('PATH_INFO', '')
+    scope = sampling_context.get('asgi_scope')
+    if scope is not None:
+        return scope.get('path', '')
+    return None
+
+
+def report_request(route, duration, status):
+    """
+    Boost the sample rate of a route after a slow or failed request.
+
+    Called by ``RequestTimingMiddleware`` at the end of every request.
+    """
+    if duration >= SLOW_REQUEST_SECONDS or status >= 500:
+        with boost_lock:
+            boosted_until[route] = time.monotonic() + BOOST_SECONDS
+
+
+def get_route_rate(route) -> float:
+    until = boosted_until.get(route)
+    if until is not None:
+        if until > time.monotonic():
+            return max(BOOST_SAMPLE_RATE, ROUTE_RATES.get(route, TRACES_SAMPLE_RATE))
+        with boost_lock:
+            boosted_until.pop(route, None)
+    return ROUTE_RATES.get(route, TRACES_SAMPLE_RATE)
+
+
+def traces_sampler(sampling_context) -> float:
+    """
+    The ``traces_sampler`` passed to ``sentry_sdk.init``.
+    """
+    # Keep the decision of an upstream service, so distributed traces stay complete
+    parent_sampled = sampling_context.get('parent_sampled')
+    if parent_sampled is not None:
+        return float(parent_sampled)
+
+    path = get_path(sampling_context)
+    if path is None:
+        # Management commands and other transactions outside of requests
+        return TRACES_SAMPLE_RATE
+    if path.startswith(IGNORED_PATH_PREFIXES):
+        return 0.0
+    route = resolve_route(path)
+    if route is None:
+        return TRACES_SAMPLE_RATE
+    return get_route_rate(route)
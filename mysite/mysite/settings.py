@@ -10,24 +10,24 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 import os
+import tempfile
 from pathlib import Path
 
 from django.urls import reverse_lazy
 from django.utils.translation import gettext_lazy as _
 import sentry_sdk
 
+from mysite import sampling
+
+# Only a share of the requests is traced, see mysite/sampling.py for the rates and their environment variables
 sentry_sdk.init(
-    dsn="https://4519f22b7b23ce7048ce50e259bc3a5a@o4507115389059072.ingest.de.sentry.io/4507115391287376",
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for performance monitoring.
-    traces_sample_rate=1.0,
-    # Set profiles_sample_rate to 1.0 to profile 100%
-    # of sampled transactions.
-    # We recommend adjusting this value in production.
-    profiles_sample_rate=1.0,
-
-    # Enable performance monitoring
-    enable_tracing=True,
+    dsn=os.environ.get(
+        'SENTRY_DSN',
+        "https://4519f22b7b23ce7048ce50e259bc3a5a@o4507115389059072.ingest.de.sentry.io/4507115391287376",
+    ),
+    traces_sampler=sampling.traces_sampler,
+    # Share of the sampled transactions that are profiled as well
+    profiles_sample_rate=sampling.PROFILES_SAMPLE_RATE,
 )
 
 
@@ -96,6 +96,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     # 'django.middleware.cache.UpdateCacheMiddleware',  # 1
+    'mysite.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -113,7 +114,7 @@ ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'mysite.template_backends.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -144,12 +145,53 @@ DATABASES = {
 
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        # 'LOCATION': 'var/tmp/django_cache',
-        'LOCATION': 'c:\\temp\\django_cache',
+        # Cache calls are timed by RequestTimingMiddleware
+        'BACKEND': 'mysite.cache_backends.TwoTierCache',
+        # Recently read values are kept in every worker for a few seconds, in front of 'shared'
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_MAX_BYTES': 16 * 1024 * 1024,
+            'LOCAL_TIMEOUT': 5,
+            'JOURNAL_POLL_INTERVAL': 1,
+            # The catalog version and locks are read from 'shared' so all workers see the same value
+            'LOCAL_EXCLUDE_PREFIXES': ['shopapp:catalog-version', 'cache-page-swr:lock:'],
+        },
+    },
+    # Needs atomic add and incr across processes, use Redis or Memcached when running on several machines
+    'shared': {
+        'BACKEND': 'mysite.cache_backends.FileBasedCache',
+        'LOCATION': os.environ.get('DJANGO_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'django_cache')),
+        'OPTIONS': {
+            # The default of 300 entries would cull a third of the cache all the time
+            'MAX_ENTRIES': 20000,
+            # Counting the entries lists the whole directory, only do it every 100 writes
+            'CULL_EVERY': 100,
+        },
     },
 }
 
+# Sends the database, cache, template and total time of every request in a Server-Timing header
+SERVER_TIMING_HEADER = True
+
+# Every worker process writes its metrics to a file in this directory, /metrics sums them.
+# Clear it on deploy. Without it /metrics only shows the process answering the scrape.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 5
+# Bearer token of the scrapers of /metrics, without it only staff users (or everyone with DEBUG) see it
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Maximum number of queries per URL name, '*' applies to all other routes.
+# Requests running more queries are logged as warnings.
+QUERY_BUDGETS = {
+    '*': 30,
+    'shopapp:index': 2,
+    'shopapp:products_list': 5,
+    'shopapp:products-list': 5,
+    'shopapp:orders-list': 5,
+    'shopapp:orders_list': 5,
+}
+
 CACHE_MIDDLEWARE_SECONDS = 200
 
 # Password validation
@@ -200,6 +242,10 @@ STATIC_URL = '/static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'uploads'
 
+# Render the resized product preview variants in the request instead of the
+# generate_preview_variants worker, e.g. for development
+PREVIEW_VARIANTS_IN_REQUEST = False
+
 ########
 STATICFILES_FINDERS = [
     'django.contrib.staticfiles.finders.AppDirectoriesFinder',
@@ -247,6 +293,8 @@ LOGFILE = BASE_DIR / 'logfile.log'
 LOGFILE_SIZE = 1 * 1024 * 1024
 LOGFILE_COUNT = 5
 
+# Records are put on a queue by the logging thread and written in batches by a background thread.
+# Handlers are created in alphabetical order, the targets of the queue handler have to come first.
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -254,22 +302,30 @@ LOGGING = {
         'verbose': {
           'format': '[%(levelname)s] %(asctime)s %(name)s: %(process)d %(thread)d %(message)s',
         },
+        # One JSON object per line with request_id, route and duration_ms, shipped to Loki
+        'json': {
+            '()': 'mysite.log_handlers.JsonFormatter',
+        },
     },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
+            'class': 'mysite.log_handlers.StreamHandler',
+            'formatter': 'json',
         },
         'logfile': {
-            'class': 'logging.handlers.RotatingFileHandler',
+            'class': 'mysite.log_handlers.GzipRotatingFileHandler',
             'filename': LOGFILE,
             'maxBytes': LOGFILE_SIZE,
             'backupCount': LOGFILE_COUNT,
-            'formatter': 'verbose',
-        }
+            'formatter': 'json',
+        },
+        'queue': {
+            '()': 'mysite.log_handlers.QueueHandler',
+            'handlers': ['cfg://handlers.console', 'cfg://handlers.logfile'],
+        },
     },
     'root': {
-        'handlers': ['console', 'logfile'],
+        'handlers': ['queue'],
         'level': 'INFO',
     },
 }
\ No newline at end of file
@@ -1,5 +1,28 @@
-from blogapp.sitemap import BlogSitemap
+from django.contrib.sitemaps.views import SitemapIndexItem, x_robots_tag
+from django.http import Http404, HttpResponse
+from django.template.response import TemplateResponse
+from django.urls import reverse
 
-sitemaps_dict = {
-    'blog': BlogSitemap,
-}
+from blogapp.sitemap import get_shard_index, get_shard_xml
+
+
+@x_robots_tag
+def sitemap_index(request):
+    """
+    The sitemap index listing a sitemap per shard of the blog articles.
+    """
+    sitemaps = [
+        SitemapIndexItem(request.build_absolute_uri(reverse('sitemap-blog', kwargs={'shard': shard})), lastmod)
+        for shard, lastmod in get_shard_index()
+    ]
+    return TemplateResponse(request, 'sitemap_index.xml', {'sitemaps': sitemaps}, content_type='application/xml')
+
+
+@x_robots_tag
+def sitemap_shard(request, shard):
+    """
+    One shard of the blog sitemap, pre-rendered and cached, see ``blogapp.sitemap``.
+    """
+    if shard not in {number for number, _ in get_shard_index()}:
+        raise Http404("No such sitemap")
+    return HttpResponse(get_shard_xml(shard), content_type='application/xml')
@@ -0,0 +1,24 @@
+from django.template.backends import django
+
+from .middleware import timed_template
+
+
+class Template(django.Template):
+    def render(self, context=None, request=None):
+        with timed_template():
+            return super().render(context, request)
+
+
+class DjangoTemplates(django.DjangoTemplates):
+    """
+    The Django template backend, adding the rendering time to the metrics of the current request.
+
+    Covers ``render()``, template responses, ``render_to_string`` and the
+    templates of DRF renderers alike.
+    """
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name).template, self)
@@ -19,8 +19,8 @@ from django.conf.urls.static import static
 from django.contrib import admin, sitemaps
 from django.urls import path, include
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
-from django.contrib.sitemaps.views import sitemap
-from .sitemaps import sitemaps_dict
+from .metrics import metrics_view
+from .sitemaps import sitemap_index, sitemap_shard
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -30,7 +30,9 @@ urlpatterns = [
     path('req/', include('requestdataapp.urls')),
     path("api/", include("myapiapp.urls")),
     path('blogapp/', include('blogapp.urls')),
-    path("sitemap.xml", sitemap, {"sitemaps": sitemaps_dict}, name="django.contrib.sitemaps.views.sitemap"),
+    path("sitemap.xml", sitemap_index, name="sitemap"),
+    path("sitemap-blog-<int:shard>.xml", sitemap_shard, name="sitemap-blog"),
+    path("metrics", metrics_view, name="metrics"),
 ]
 
 urlpatterns += i18n_patterns(
@@ -43,8 +45,6 @@ urlpatterns += i18n_patterns(
     path("api/schema/redoc/", SpectacularRedocView.as_view(url_name='schema'), name="redoc"),
     path("api/", include("myapiapp.urls")),
     path('blogapp/', include('blogapp.urls')),
-    path(r'^sitemap\.xml$', sitemap, {'sitemaps': sitemaps_dict},
-         name='django.contrib.sitemaps.views.sitemap'),
 )
 
 if settings.DEBUG:
@@ -1,16 +1,17 @@
 import csv
 from io import TextIOWrapper
 
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.db.models import QuerySet
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render, redirect
 from django.urls import path
 
-from .common import save_csv_products
+from .common import save_csv_products, update_products
+from .search import is_search_available, search_products
 
 # Import our Product and Order models
-from .models import Product, Order
+from .models import Product, Order, ProductImportJob
 
 # Import our mixin that allows us to export data to CSV
 from .admin_mixins import ExportAsCSVMixin
@@ -30,14 +31,14 @@ def mark_archived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset:
         Change the archived status of selected rows.
     """
     # Set the 'archived' field of selected rows to be True
-    queryset.update(archived=True)
+    update_products(queryset, archived=True)
 
 
 # Define an admin action to set product to unarchived
 @admin.action(description="Unarchived products")
 def mark_unarchived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
     # Set the 'archived' field of selected rows to be False
-    queryset.update(archived=False)
+    update_products(queryset, archived=False)
 
 
 # Define the admin interface for the Product model
@@ -67,6 +68,12 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
     # Also search for entered terms in the Product's `name` and `description` fields
     search_fields = "name", "description"
 
+    # Use the full-text index for the search box when it is available
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or not is_search_available():
+            return super().get_search_results(request, queryset, search_term)
+        return search_products(queryset, search_term), False
+
     # Define sections of the detail view of an object, each item in fieldsets is a tuple, where the first element
     # is a name of the section
     fieldsets = [
@@ -116,11 +123,19 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
             }
             return render(request, 'admin/csv_form.html', context, status=400)
 
-        save_csv_products(
-            file = request.FILES['csv_file'],
+        summary = save_csv_products(
+            file=request.FILES['csv_file'].file,
             encoding=request.encoding,
+            created_by=request.user,
+        )
+        # Warn the admin about rows that were skipped
+        level = messages.WARNING if summary['rejected'] else messages.SUCCESS
+        self.message_user(
+            request,
+            "Imported {inserted} of {rows_read} products from CSV file, "
+            "{rejected} rows rejected ({elapsed}s).".format(**summary),
+            level=level,
         )
-        self.message_user(request, "Successfully imported products from CSV file.")
         return redirect('..')
 
     # Method extends standard URL routing of Django Admin with a custom URL for CSV importing
@@ -152,12 +167,21 @@ class OrderAdmin(admin.ModelAdmin):
     ]
 
     # Set which fields are displayed in the list view
-    list_display = "delivery_address", "promocode", "created_at", "user_verbose"
+    list_display = "delivery_address", "promocode", "created_at", "user_verbose", "items_count", "total", "discounted_total"
 
-    # Overrides the get_queryset method for a custom one to improve performance
+    # Overrides the get_queryset method for a custom one to improve performance,
+    # the totals are stored on the order so the products are not loaded
     def get_queryset(self, request):
-        return Order.objects.select_related("user").prefetch_related("products")
+        return Order.objects.select_related("user")
 
     # Presents a user's first name or username in the list view
     def user_verbose(self, obj: Order) -> str:
         return obj.user.first_name or obj.user.username
+
+
+# Define the admin interface for the product import jobs, they are only created through the API
+@admin.register(ProductImportJob)
+class ProductImportJobAdmin(admin.ModelAdmin):
+    list_display = "pk", "status", "created_by", "created_at", "rows_read", "inserted", "rejected"
+    list_filter = "status",
+    readonly_fields = [field.name for field in ProductImportJob._meta.fields]
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ShopappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shopapp'
+
+    def ready(self):
+        # Connect the signal receivers keeping derived product data in sync
+        from . import signals  # noqa: F401
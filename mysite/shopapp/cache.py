@@ -0,0 +1,132 @@
+import hashlib
+import time
+import uuid
+
+from django.core.cache import cache
+
+from mysite.caching import HIT, MISS, STALE, cache_page_swr
+from mysite.metrics import CATALOG_CACHE_LOOKUPS, registry
+
+# Cached catalog responses carry this version in their key, changing it invalidates all of them at once
+CATALOG_VERSION_KEY = 'shopapp:catalog-version'
+
+# Version of the cached fragments of a single product, e.g. its card in the products list
+PRODUCT_VERSION_KEY = 'shopapp:product-version:{pk}'
+
+# Cached product cards are dropped after this time even if the product did not change
+PRODUCT_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Catalog responses stay valid until the catalog changes, the timeout only limits the cache size
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 6
+
+# Request headers changing the content of a catalog response
+CATALOG_VARY_HEADERS = ('HTTP_ACCEPT', 'HTTP_ACCEPT_LANGUAGE', 'HTTP_AUTHORIZATION')
+
+
+def new_catalog_version() -> int:
+    # A clock based value never repeats a version used before the key was evicted
+    return int(time.time() * 1000)
+
+
+def get_catalog_version() -> int:
+    """
+    Return the current catalog version, creating it when missing.
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, new_catalog_version(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """
+    Invalidate every cached catalog response.
+    """
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, new_catalog_version(), None)
+
+
+def get_product_versions(pks) -> dict:
+    """
+    Return the cache versions of the given products, creating missing ones.
+
+    Cached fragments of a product carry its version in the key, see
+    ``bump_product_versions``.
+
+    :param pks: The primary keys of the products.
+    :return: A dict mapping each pk to its version.
+    """
+    keys = {pk: PRODUCT_VERSION_KEY.format(pk=pk) for pk in pks}
+    stored = cache.get_many(keys.values())
+    versions = {}
+    missing = {}
+    for pk, key in keys.items():
+        if key in stored:
+            versions[pk] = stored[key]
+        else:
+            versions[pk] = missing[key] = uuid.uuid4().hex
+    if missing:
+        cache.set_many(missing, None)
+    return versions
+
+
+def bump_product_versions(pks):
+    """
+    Invalidate the cached fragments of the given products.
+    """
+    cache.delete_many([PRODUCT_VERSION_KEY.format(pk=pk) for pk in pks])
+
+
+def get_catalog_cache_stats() -> dict:
+    """
+    Return the hits, misses and hit ratio of the cached catalog responses.
+
+    The lookups are counted in the metrics of every process, see
+    ``mysite.metrics``, stale responses count as hits.
+    """
+    lookups = registry.collect().get(CATALOG_CACHE_LOOKUPS.name, {})
+    hits = lookups.get((HIT,), 0) + lookups.get((STALE,), 0)
+    misses = lookups.get((MISS,), 0)
+    total = hits + misses
+    return {
+        'version': get_catalog_version(),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else 0.0,
+    }
+
+
+def get_catalog_cache_key(request) -> str:
+    """
+    Build the cache key of a catalog response from the catalog version,
+    the full URL and the headers changing the response.
+    """
+    parts = [request.method, request.build_absolute_uri()]
+    parts.extend(request.META.get(header, '') for header in CATALOG_VARY_HEADERS)
+    digest = hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+    return f'shopapp:catalog:{get_catalog_version()}:{digest}'
+
+
+def count_catalog_lookup(result):
+    # Counted in process, a write to the shared cache on every request would cost more than the lookup
+    CATALOG_CACHE_LOOKUPS.inc(result=result)
+
+
+def cache_catalog_response(timeout=CATALOG_CACHE_TIMEOUT):
+    """
+    Cache successful GET responses of a catalog view until the catalog changes.
+
+    Works like ``cache_page`` but the keys contain the catalog version, which
+    is bumped whenever a product is saved, deleted or updated in bulk. After
+    a bump only one request renders each response, see ``cache_page_swr``.
+    Use with ``method_decorator`` on class based views.
+
+    :param timeout: Seconds before a cached response is dropped anyway.
+    """
+    # Clients must not keep responses that are invalidated by version bumps
+    return cache_page_swr(
+        timeout, key_func=get_catalog_cache_key, on_lookup=count_catalog_lookup, patch_headers=False,
+    )
@@ -1,17 +1,315 @@
 import csv
+import logging
 from io import TextIOWrapper
+from timeit import default_timer
 
-from .models import Product
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
 
+from mysite.metrics import CSV_ROWS
 
-def save_csv_products(file, endcoding):
-    csv_file = TextIOWrapper(
-        file, encoding=endcoding,
-    )
+from .forms import ProductForm
+from .models import Order, Product, ProductImportJob
+from .orders import discounted_price
+from .serializers import OrderBulkItemSerializer
+from .signals import products_changed
+from .stats import count_products
+
+log = logging.getLogger(__name__)
+
+# Rows are pulled from the database in chunks of this size while exporting
+CSV_EXPORT_CHUNK_SIZE = 2000
+
+# Products are inserted in batches of this size while importing
+CSV_IMPORT_BATCH_SIZE = 1000
+
+# Only the first errors are kept in the import summary, the rest are only counted
+CSV_IMPORT_MAX_ERRORS = 100
+
+# Orders and their product links are inserted in batches of this size
+ORDER_BULK_BATCH_SIZE = 1000
+
+# The bulk order endpoint rejects requests with more orders than this
+ORDER_BULK_MAX_ITEMS = 5000
+
+
+class Echo:
+    """
+    A file-like object that returns the written value instead of buffering it.
+    Lets ``csv.writer`` produce lines that can be streamed one by one.
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_csv_rows(queryset, fields, chunk_size=CSV_EXPORT_CHUNK_SIZE):
+    """
+    Yield the header and then one CSV line per object of the queryset.
+
+    Only the requested fields are selected and the rows are read with a
+    server-side iterator, so memory usage does not depend on the queryset size.
+
+    :param queryset: The queryset to export.
+    :param fields: The field names to export, in column order.
+    :param chunk_size: The number of rows fetched from the database at once.
+    :return: A generator of CSV encoded lines.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+    exported = 0
+    for row in rows:
+        yield writer.writerow(row)
+        exported += 1
+        if exported == chunk_size:
+            CSV_ROWS.inc(exported, operation='export', result='exported')
+            exported = 0
+    CSV_ROWS.inc(exported, operation='export', result='exported')
+
+
+def update_products(queryset, **values):
+    """
+    Update products in bulk and keep the data derived from them in sync.
+
+    ``QuerySet.update()`` does not send ``post_save`` and skips ``auto_now``,
+    so this sets ``last_modified`` and sends ``products_changed`` with the
+    counters of the products before the update.
+
+    :param queryset: The products to update.
+    :param values: The new field values.
+    :return: The number of updated products.
+    """
+    pks = list(queryset.values_list('pk', flat=True))
+    products = Product.objects.filter(pk__in=pks)
+    values.setdefault('last_modified', timezone.now())
+    with transaction.atomic():
+        previous = count_products(products)
+        updated = products.update(**values)
+        products_changed.send(sender=Product, pks=pks, fields=list(values), previous=previous)
+    return updated
+
+
+def save_csv_products(file, encoding, created_by, batch_size=CSV_IMPORT_BATCH_SIZE, on_progress=None):
+    """
+    Import products from a CSV file.
+
+    Rows are read one by one, validated with ``ProductForm`` and inserted with
+    ``bulk_create`` in batches of ``batch_size``, each batch in its own
+    transaction. Invalid rows are skipped and reported in the summary.
+
+    :param file: The binary file object with the CSV data.
+    :param encoding: The encoding of the file, UTF-8 when not given.
+    :param created_by: The user set as the author of the imported products.
+    :param batch_size: The number of products inserted per query.
+    :param on_progress: Optional callable receiving the summary after each batch.
+    :return: A summary dict with rows_read, inserted, rejected, errors and elapsed seconds.
+    """
+    started = default_timer()
+    summary = {
+        'rows_read': 0,
+        'inserted': 0,
+        'rejected': 0,
+        'errors': [],
+        'elapsed': 0.0,
+    }
+
+    def flush(batch):
+        if batch:
+            with transaction.atomic():
+                Product.objects.bulk_create(batch)
+                products_changed.send(sender=Product, pks=[product.pk for product in batch])
+            summary['inserted'] += len(batch)
+            CSV_ROWS.inc(len(batch), operation='import', result='inserted')
+        summary['elapsed'] = round(default_timer() - started, 3)
+        if on_progress is not None:
+            on_progress(summary)
+
+    csv_file = TextIOWrapper(file, encoding=encoding or 'utf-8')
     reader = csv.DictReader(csv_file)
-    products = [
-        Product(**row)
-        for row in reader
-    ]
-    Product.objects.bulk_create(products)
-    return products
+    batch = []
+    for row in reader:
+        summary['rows_read'] += 1
+        form = ProductForm(data=row)
+        if not form.is_valid():
+            summary['rejected'] += 1
+            CSV_ROWS.inc(operation='import', result='rejected')
+            if len(summary['errors']) < CSV_IMPORT_MAX_ERRORS:
+                summary['errors'].append({
+                    # line_num counts the header line as well
+                    'line': reader.line_num,
+                    'errors': {field: list(messages) for field, messages in form.errors.items()},
+                })
+            continue
+
+        product = form.save(commit=False)
+        product.created_by = created_by
+        batch.append(product)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+
+    flush(batch)
+    return summary
+
+
+def create_orders(items, user, batch_size=ORDER_BULK_BATCH_SIZE):
+    """
+    Create many orders with their products in a few queries.
+
+    Every item is validated with ``OrderBulkItemSerializer``, the referenced
+    users and products are loaded with one query each. The valid orders are
+    inserted with ``bulk_create``, then their product links, all in one
+    transaction. The order summaries are computed before the insert, so the
+    orders do not have to be updated afterwards. Invalid items are skipped
+    and reported in the summary.
+
+    :param items: A list of dicts with user (optional), delivery_address,
+        promocode and products (a list of product pks).
+    :param user: The user of the orders without a user.
+    :param batch_size: The number of rows inserted per query.
+    :return: A summary dict with created, rejected, the pks of the created
+        orders and errors (each with the index of the item).
+    """
+    summary = {
+        'created': 0,
+        'rejected': 0,
+        'orders': [],
+        'errors': [],
+    }
+
+    def reject(index, errors):
+        summary['rejected'] += 1
+        summary['errors'].append({'index': index, 'errors': errors})
+
+    valid = []
+    for index, item in enumerate(items):
+        serializer = OrderBulkItemSerializer(data=item)
+        if not serializer.is_valid():
+            reject(index, serializer.errors)
+            continue
+        data = serializer.validated_data
+        # A product can only be linked once to an order
+        data['products'] = list(dict.fromkeys(data['products']))
+        valid.append((index, data))
+
+    user_pks = {data['user'] for _, data in valid if 'user' in data}
+    existing_users = set(User.objects.filter(pk__in=user_pks).values_list('pk', flat=True))
+    product_pks = {pk for _, data in valid for pk in data['products']}
+    prices = {
+        pk: (price, discount)
+        for pk, price, discount in Product.objects.filter(pk__in=product_pks).values_list('pk', 'price', 'discount')
+    }
+
+    orders = []
+    order_products = []
+    for index, data in valid:
+        errors = {}
+        if 'user' in data and data['user'] not in existing_users:
+            errors['user'] = [f"Invalid pk \"{data['user']}\" - object does not exist."]
+        missing = [pk for pk in data['products'] if pk not in prices]
+        if missing:
+            errors['products'] = [f"Invalid pk \"{pk}\" - object does not exist." for pk in missing]
+        if errors:
+            reject(index, errors)
+            continue
+        orders.append(Order(
+            user_id=data.get('user', user.pk),
+            delivery_address=data['delivery_address'],
+            promocode=data['promocode'],
+            items_count=len(data['products']),
+            total=sum(prices[pk][0] for pk in data['products']),
+            discounted_total=sum(discounted_price(*prices[pk]) for pk in data['products']),
+        ))
+        order_products.append(data['products'])
+
+    with transaction.atomic():
+        Order.objects.bulk_create(orders, batch_size=batch_size)
+        through = Order.products.through
+        through.objects.bulk_create(
+            [
+                through(order_id=order.pk, product_id=product_pk)
+                for order, products in zip(orders, order_products)
+                for product_pk in products
+            ],
+            batch_size=batch_size,
+        )
+
+    summary['created'] = len(orders)
+    summary['orders'] = [order.pk for order in orders]
+    return summary
+
+
+def claim_import_job():
+    """
+    Take the oldest queued import job and mark it as running.
+
+    The status is switched with a conditional UPDATE, so several workers can
+    poll the queue at the same time without running a job twice.
+
+    :return: The claimed job or None when the queue is empty.
+    """
+    queued = ProductImportJob.objects.filter(status=ProductImportJob.STATUS_QUEUED)
+    while True:
+        job = queued.order_by('created_at', 'pk').first()
+        if job is None:
+            return None
+        claimed = queued.filter(pk=job.pk).update(
+            status=ProductImportJob.STATUS_RUNNING,
+            started_at=timezone.now(),
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def run_import_job(job):
+    """
+    Import the file of a claimed job, saving the progress after each batch.
+
+    The uploaded file is removed once the import succeeded and kept for
+    inspection when it failed.
+
+    :param job: A ProductImportJob in the running state.
+    :return: The updated job.
+    """
+    jobs = ProductImportJob.objects.filter(pk=job.pk)
+    with job.file.storage.open(job.file.name, 'rb') as upload:
+        file = upload.file
+
+        def on_progress(summary):
+            jobs.update(
+                rows_read=summary['rows_read'],
+                inserted=summary['inserted'],
+                rejected=summary['rejected'],
+                errors=summary['errors'],
+                bytes_read=file.tell(),
+            )
+
+        try:
+            save_csv_products(
+                file,
+                encoding=job.encoding,
+                created_by=job.created_by,
+                on_progress=on_progress,
+            )
+        except Exception as exc:
+            log.exception("Product import job %s failed", job.pk)
+            jobs.update(
+                status=ProductImportJob.STATUS_FAILED,
+                error=str(exc),
+                finished_at=timezone.now(),
+            )
+            job.refresh_from_db()
+            return job
+
+    job.file.delete(save=False)
+    jobs.update(
+        file='',
+        status=ProductImportJob.STATUS_DONE,
+        bytes_read=job.bytes_total,
+        finished_at=timezone.now(),
+    )
+    job.refresh_from_db()
+    return job
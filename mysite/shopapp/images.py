@@ -0,0 +1,130 @@
+import os
+import posixpath
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+# Widths in pixels of the resized preview variants
+PREVIEW_WIDTHS = (160, 320, 640)
+
+# Encoding of the variants, WebP keeps transparency and is smaller than PNG and JPEG
+PREVIEW_FORMAT = 'WEBP'
+PREVIEW_EXTENSION = 'webp'
+PREVIEW_QUALITY = 80
+
+# The variants of products/product_1/preview/desk.png are stored in products/product_1/preview/variants/
+VARIANTS_DIR = 'variants'
+
+
+def render_variants(source_path, target_dir, stem):
+    """
+    Write resized and recompressed copies of an image.
+
+    Runs in the processes of the ``generate_preview_variants`` worker, so it
+    only works with file paths and does not touch the database.
+
+    :param source_path: The absolute path of the original image.
+    :param target_dir: The absolute path of the directory for the variants.
+    :param stem: The file name of the original image without extension.
+    :return: A dict mapping the width (as a string) to the written file name.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    variants = {}
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        for width in PREVIEW_WIDTHS:
+            # Images are never upscaled, smaller originals only get the first variant
+            if width > image.width and variants:
+                break
+            variant = image.copy()
+            variant.thumbnail((width, width * 4), Image.Resampling.LANCZOS)
+            filename = f'{stem}_{width}w.{PREVIEW_EXTENSION}'
+            variant.save(os.path.join(target_dir, filename), PREVIEW_FORMAT, quality=PREVIEW_QUALITY, method=4)
+            variants[str(width)] = filename
+    return variants
+
+
+def variant_paths(product):
+    """
+    Return the arguments of ``render_variants`` for the preview of a product.
+    """
+    storage = product.preview.storage
+    source_path = storage.path(product.preview.name)
+    target_dir = os.path.join(os.path.dirname(source_path), VARIANTS_DIR)
+    stem = os.path.splitext(os.path.basename(product.preview.name))[0]
+    return source_path, target_dir, stem
+
+
+def save_variants(pk, source, filenames):
+    """
+    Store the names of the rendered variants on the product.
+
+    Nothing is saved when the preview was replaced in the meantime.
+
+    :param pk: The primary key of the product.
+    :param source: The name of the preview the variants were made from.
+    :param filenames: The result of ``render_variants``.
+    """
+    from .models import Product
+    from .signals import products_changed
+
+    directory = posixpath.join(posixpath.dirname(source), VARIANTS_DIR)
+    variants = {
+        'source': source,
+        'widths': {
+            width: f'{directory}/{filename}'
+            for width, filename in filenames.items()
+        },
+    }
+    updated = Product.objects.filter(pk=pk, preview=source).update(
+        preview_variants=variants, last_modified=timezone.now(),
+    )
+    if updated:
+        products_changed.send(sender=Product, pks=[pk], fields=['preview_variants'])
+
+
+def generate_preview_variants(product):
+    """
+    Render the variants of a product preview in the current process.
+
+    :param product: A Product with a preview image.
+    """
+    filenames = render_variants(*variant_paths(product))
+    save_variants(product.pk, product.preview.name, filenames)
+
+
+def pending_previews(queryset):
+    """
+    Filter the products whose preview has no variants yet, e.g. a new upload.
+
+    :param queryset: A Product queryset.
+    """
+    return (
+        queryset
+        .exclude(preview='')
+        .exclude(preview__isnull=True)
+        .filter(Q(preview_variants__source__isnull=True) | ~Q(preview_variants__source=F('preview')))
+    )
+
+
+def schedule_preview_variants(product):
+    """
+    Render the variants of a product preview once the current transaction is
+    committed, when ``PREVIEW_VARIANTS_IN_REQUEST`` is set.
+
+    Otherwise the ``generate_preview_variants --watch`` worker picks up the
+    product, so web workers never resize images.
+
+    :param product: A Product with a preview image.
+    """
+    if not settings.PREVIEW_VARIANTS_IN_REQUEST:
+        return
+    pk = product.pk
+    source = product.preview.name
+    paths = variant_paths(product)
+    transaction.on_commit(lambda: save_variants(pk, source, render_variants(*paths)))
@@ -0,0 +1,248 @@
+import json
+import math
+import platform
+import statistics
+import tracemalloc
+from timeit import default_timer
+
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from blogapp.models import Article
+from shopapp.models import Order, Product
+
+from .seed_data import SIZES
+
+# Name, URL name, arguments, query string and whether the route needs a logged-in user
+ROUTES = [
+    ('shop-index', 'shopapp:index', None, '', False),
+    ('product-list', 'shopapp:products_list', None, '', False),
+    ('product-list-page-5', 'shopapp:products_list', None, '?page=5', False),
+    ('product-detail', 'shopapp:product_details', 'product', '', False),
+    ('order-list', 'shopapp:orders_list', None, '', True),
+    ('order-detail', 'shopapp:order_details', 'order', '', True),
+    ('api-product-list', 'shopapp:products-list', None, '', False),
+    ('api-product-search', 'shopapp:products-list', None, '?search=desk', False),
+    ('api-product-detail', 'shopapp:products-detail', 'product', '', False),
+    ('api-product-stats', 'shopapp:products-stats', None, '', False),
+    ('api-order-list', 'shopapp:orders-list', None, '', False),
+    ('api-order-list-by-total', 'shopapp:orders-list', None, '?ordering=-total', False),
+    ('csv-export', 'shopapp:products-download-csv', None, '', False),
+    ('blog-list', 'blogapp:articles', None, '', False),
+    ('blog-detail', 'blogapp:article_details', 'article', '', False),
+    ('blog-feed', 'blogapp:articles_feed', None, '', False),
+    ('sitemap', 'sitemap', None, '', False),
+]
+
+# Metrics compared with --compare, a route regresses when one grows by more than the threshold
+COMPARED_METRICS = ('p95_ms', 'queries', 'peak_memory_kb')
+
+
+def percentile(values, percent):
+    """
+    Return the nearest-rank percentile of a list of numbers.
+    """
+    values = sorted(values)
+    if not values:
+        return 0.0
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def find_regressions(baseline, current, threshold):
+    """
+    Compare two benchmark results.
+
+    :param baseline: The results of an earlier run, as written by this command.
+    :param current: The results of this run.
+    :param threshold: The allowed relative growth of a metric, e.g. 0.2 for 20%.
+    :return: A list of (size, route, metric, baseline value, current value).
+    """
+    regressions = []
+    for size, routes in current['sizes'].items():
+        for route, metrics in routes.items():
+            before = baseline.get('sizes', {}).get(size, {}).get(route)
+            if before is None:
+                continue
+            for metric in COMPARED_METRICS:
+                old, new = before.get(metric), metrics.get(metric)
+                if old is None or new is None:
+                    continue
+                # Query counts are exact, a single extra query is a regression
+                allowed = old if metric == 'queries' else old * (1 + threshold)
+                if new > allowed:
+                    regressions.append((size, route, metric, old, new))
+    return regressions
+
+
+class QueryRecorder:
+    """
+    A database execute wrapper counting the queries and their time.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = default_timer()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += default_timer() - started
+
+
+class Command(BaseCommand):
+    """
+    Measures the latency and SQL usage of the main routes against seeded databases
+    """
+    help = "Benchmark the main shop and blog routes on seeded test databases and write the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', choices=SIZES, default=['small'], help="Seed presets to benchmark")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the generated data")
+        parser.add_argument('--iterations', type=int, default=20, help="Measured requests per route")
+        parser.add_argument('--warmup', type=int, default=2, help="Unmeasured requests per route")
+        parser.add_argument('--routes', nargs='+', help="Only benchmark these routes")
+        parser.add_argument('--output', default='benchmark-results.json', help="File the results are written to")
+        parser.add_argument('--compare', help="Results of an earlier run to check for regressions")
+        parser.add_argument('--threshold', type=float, default=0.2, help="Allowed relative growth of a metric")
+        parser.add_argument(
+            '--current-db', action='store_true',
+            help="Benchmark the configured database as it is instead of seeded test databases",
+        )
+
+    def handle(self, *args, **options):
+        routes = ROUTES
+        if options['routes']:
+            unknown = set(options['routes']) - {route[0] for route in ROUTES}
+            if unknown:
+                raise CommandError(f"Unknown routes: {', '.join(sorted(unknown))}")
+            routes = [route for route in ROUTES if route[0] in options['routes']]
+
+        results = {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'sizes': {},
+        }
+        if options['current_db']:
+            # The shared cache of the running site is left alone, routes are measured as it is
+            results['sizes']['current'] = self.run_routes(routes, options, clear_cache=False)
+        else:
+            setup_test_environment()
+            try:
+                for size in options['sizes']:
+                    results['sizes'][size] = self.run_size(size, routes, options)
+            finally:
+                teardown_test_environment()
+
+        with open(options['output'], 'w') as file:
+            json.dump(results, file, indent=2)
+        self.stdout.write(f"Results written to {options['output']}")
+
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)
+            regressions = find_regressions(baseline, results, options['threshold'])
+            for size, route, metric, old, new in regressions:
+                self.stdout.write(self.style.ERROR(f"{size} {route}: {metric} {old} -> {new}"))
+            if regressions:
+                raise CommandError(f"{len(regressions)} regressions compared to {options['compare']}")
+            self.stdout.write(self.style.SUCCESS("No regressions"))
+
+    def run_size(self, size, routes, options):
+        self.stdout.write(f"Create and seed the {size} database")
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            call_command('seed_data', size=size, seed=options['seed'], stdout=self.stdout)
+            return self.run_routes(routes, options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    def run_routes(self, routes, options, clear_cache=True):
+        objects = {
+            'product': Product.objects.filter(archived=False).order_by('pk').values_list('pk', flat=True).first(),
+            'order': Order.objects.order_by('pk').values_list('pk', flat=True).first(),
+            'article': Article.objects.order_by('pk').values_list('pk', flat=True).first(),
+        }
+        user = User.objects.filter(is_active=True).order_by('pk').first()
+
+        measured = {}
+        for name, url_name, argument, query, login in routes:
+            if argument is not None and objects[argument] is None:
+                self.stdout.write(f"Skip {name}, there is no {argument}")
+                continue
+            if login and user is None:
+                self.stdout.write(f"Skip {name}, there is no user")
+                continue
+            client = Client()
+            if login:
+                client.force_login(user)
+            kwargs = {'pk': objects[argument]} if argument is not None else None
+            url = reverse(url_name, kwargs=kwargs) + query
+            if clear_cache:
+                # Every route starts with a cold cache, the first measured requests pay for filling it
+                cache.clear()
+            measured[name] = self.measure(client, url, options['iterations'], options['warmup'])
+            metrics = measured[name]
+            self.stdout.write(
+                f"{name:<26} {metrics['status']} p50 {metrics['p50_ms']:>8.2f}ms  p95 {metrics['p95_ms']:>8.2f}ms  "
+                f"p99 {metrics['p99_ms']:>8.2f}ms  {metrics['queries']:>3} queries  "
+                f"{metrics['sql_ms']:>7.2f}ms SQL  {metrics['peak_memory_kb']:>8.1f}KB"
+            )
+        return measured
+
+    def measure(self, client, url, iterations, warmup):
+        def request():
+            response = client.get(url)
+            if response.streaming:
+                # Streaming responses are produced while they are consumed
+                for _ in response.streaming_content:
+                    pass
+            return response
+
+        for _ in range(warmup):
+            request()
+
+        durations = []
+        queries = []
+        sql_durations = []
+        for _ in range(max(iterations, 1)):
+            recorder = QueryRecorder()
+            with connection.execute_wrapper(recorder):
+                started = default_timer()
+                response = request()
+                durations.append((default_timer() - started) * 1000)
+            queries.append(recorder.count)
+            sql_durations.append(recorder.duration * 1000)
+
+        # tracemalloc slows everything down, so memory is measured with a separate request
+        tracemalloc.start()
+        try:
+            request()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'url': url,
+            'status': response.status_code,
+            'p50_ms': round(percentile(durations, 50), 3),
+            'p95_ms': round(percentile(durations, 95), 3),
+            'p99_ms': round(percentile(durations, 99), 3),
+            'mean_ms': round(statistics.fmean(durations), 3),
+            'queries': max(queries),
+            'sql_ms': round(statistics.median(sql_durations), 3),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
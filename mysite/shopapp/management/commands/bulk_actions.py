@@ -2,6 +2,7 @@ from django.contrib.auth.models import User
 from django.core.management import BaseCommand
 from django.db import transaction
 
+from shopapp.common import update_products
 from shopapp.models import Order, Product
 from typing_extensions import Sequence
 
@@ -25,7 +26,7 @@ class Command(BaseCommand):
             # self.stdout.write(self.style.SUCCESS('Successfully created products'))
 
             # Update products
-            Product.objects.filter(name__contains='Smartphone').update(discount=15)
+            update_products(Product.objects.filter(name__contains='Smartphone'), discount=15)
             # count all updated products:
             count = Product.objects.filter(name__contains='Smartphone', discount=15).acount()
             self.stdout.write(self.style.SUCCESS(f'Successfully updated {count} products'))
@@ -18,6 +18,5 @@ class Command(BaseCommand):
             promocode="promo5",
             user=user,
         )
-        for product in products:
-            order.products.add(product)
+        order.products.add(*products)
         self.stdout.write(f"Created order {order}")
@@ -0,0 +1,74 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management import BaseCommand
+
+from shopapp.images import pending_previews, render_variants, save_variants, variant_paths
+from shopapp.models import Product
+
+
+class Command(BaseCommand):
+    """
+    Renders the resized variants of product previews outside the web workers
+    """
+    help = "Render the resized preview variants of products in a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of processes rendering images, defaults to the number of CPUs",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Render the variants again even if they are up to date",
+        )
+        parser.add_argument(
+            "--watch",
+            action="store_true",
+            help="Keep polling for new previews until stopped",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2.0,
+            help="Seconds to wait between polls when there are no new previews",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Render product preview variants")
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            if options["force"]:
+                products = Product.objects.exclude(preview='').exclude(preview__isnull=True)
+            else:
+                products = pending_previews(Product.objects.all())
+            rendered, failed = self.render(executor, products)
+            self.stdout.write(self.style.SUCCESS(f"Rendered variants of {rendered} products, {failed} failed"))
+
+            while options["watch"]:
+                rendered, failed = self.render(executor, pending_previews(Product.objects.all()))
+                if rendered or failed:
+                    self.stdout.write(f"Rendered variants of {rendered} products, {failed} failed")
+                if not rendered:
+                    # Previews which failed are retried after a pause
+                    time.sleep(options["poll_interval"])
+
+    def render(self, executor, products):
+        futures = {}
+        for product in products.only('pk', 'preview', 'preview_variants').iterator(chunk_size=500):
+            future = executor.submit(render_variants, *variant_paths(product))
+            futures[future] = (product.pk, product.preview.name)
+
+        rendered = failed = 0
+        for future in as_completed(futures):
+            pk, source = futures[future]
+            try:
+                save_variants(pk, source, future.result())
+            except Exception as exc:
+                failed += 1
+                self.stderr.write(f"Product {pk}: {exc}")
+            else:
+                rendered += 1
+        return rendered, failed
@@ -0,0 +1,18 @@
+from django.core.management import BaseCommand
+
+from shopapp.stats import get_catalog_stats, rebuild_catalog_stats
+
+
+class Command(BaseCommand):
+    """
+    Recomputes the catalog statistics counters
+    """
+    help = "Compute the catalog statistics counters again from the product table"
+
+    def handle(self, *args, **options):
+        self.stdout.write("Rebuild catalog statistics")
+        rebuild_catalog_stats()
+        stats = get_catalog_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"Counted {stats['total']} products, {stats['archived']} archived"
+        ))
@@ -0,0 +1,15 @@
+from django.core.management import BaseCommand
+
+from shopapp.orders import rebuild_order_summaries
+
+
+class Command(BaseCommand):
+    """
+    Recomputes the stored order totals
+    """
+    help = "Compute the item count and totals of all orders again from their products"
+
+    def handle(self, *args, **options):
+        self.stdout.write("Rebuild order summaries")
+        count = rebuild_order_summaries()
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {count} orders"))
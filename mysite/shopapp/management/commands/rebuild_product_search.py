@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand
+
+from shopapp.search import is_search_available, rebuild_index
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the product full-text search index
+    """
+    help = "Fill the product full-text index again from the product table"
+
+    def handle(self, *args, **options):
+        if not is_search_available():
+            self.stdout.write(self.style.WARNING("Full-text search is only available with SQLite"))
+            return
+
+        self.stdout.write("Rebuild product search index")
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} products"))
@@ -0,0 +1,86 @@
+import multiprocessing
+import time
+
+import django
+from django.apps import apps
+from django.core.management import BaseCommand
+from django.db import connections
+
+
+def work(poll_interval, once, stdout=None):
+    """
+    Run queued product import jobs until stopped.
+
+    :param poll_interval: Seconds to wait before polling an empty queue again.
+    :param once: Exit as soon as the queue is empty.
+    :param stdout: Optional stream for progress messages.
+    """
+    # Processes started with "spawn" begin with an unconfigured Django,
+    # so the models are only imported once it is set up
+    if not apps.ready:
+        django.setup()
+    from shopapp.common import claim_import_job, run_import_job
+
+    while True:
+        job = claim_import_job()
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        job = run_import_job(job)
+        if stdout is not None:
+            stdout.write(
+                f"Import job {job.pk} {job.status}: {job.inserted} inserted, "
+                f"{job.rejected} rejected, {job.rows_per_second} rows/s"
+            )
+
+
+class Command(BaseCommand):
+    """
+    Runs queued product CSV imports outside the web workers
+    """
+    help = "Process queued product CSV import jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="Number of worker processes importing jobs in parallel",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2.0,
+            help="Seconds to wait between polls of an empty queue",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when there are no queued jobs left",
+        )
+
+    def handle(self, *args, **options):
+        processes = max(options["processes"], 1)
+        poll_interval = options["poll_interval"]
+        once = options["once"]
+        self.stdout.write(f"Start import worker with {processes} process(es)")
+
+        if processes == 1:
+            work(poll_interval, once, stdout=self.stdout)
+            self.stdout.write(self.style.SUCCESS("Import worker finished"))
+            return
+
+        # Database connections must not be shared with the child processes
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=work, args=(poll_interval, once))
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.stdout.write(self.style.SUCCESS("Import worker finished"))
@@ -0,0 +1,216 @@
+import random
+from array import array
+from datetime import timedelta
+from decimal import Decimal
+from timeit import default_timer
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import Profile
+from blogapp.models import EXCERPT_LENGTH, Article, Author, Category, Tag
+from blogapp.sitemap import build_sitemaps
+from shopapp.cache import bump_catalog_version
+from shopapp.models import Order, Product
+from shopapp.orders import discounted_price
+from shopapp.search import rebuild_index
+from shopapp.stats import rebuild_catalog_stats
+
+# Number of rows per model for each size preset
+SIZES = {
+    'tiny': {'users': 20, 'products': 200, 'orders': 300, 'articles': 100},
+    'small': {'users': 200, 'products': 10_000, 'orders': 20_000, 'articles': 2_000},
+    'medium': {'users': 5_000, 'products': 200_000, 'orders': 500_000, 'articles': 50_000},
+    'large': {'users': 50_000, 'products': 2_000_000, 'orders': 5_000_000, 'articles': 500_000},
+}
+
+# Seeded usernames start with this prefix, so repeated runs do not collide
+USERNAME_PREFIX = 'seed_'
+
+ADJECTIVES = [
+    'Compact', 'Classic', 'Wireless', 'Ergonomic', 'Portable', 'Smart', 'Vintage', 'Premium',
+    'Foldable', 'Waterproof', 'Silent', 'Modular', 'Lightweight', 'Heavy-duty', 'Digital', 'Organic',
+]
+NOUNS = [
+    'Laptop', 'Desk', 'Lamp', 'Chair', 'Headphones', 'Keyboard', 'Monitor', 'Backpack', 'Kettle',
+    'Camera', 'Speaker', 'Bicycle', 'Jacket', 'Notebook', 'Blender', 'Watch', 'Tent', 'Router',
+]
+WORDS = (
+    'quality design durable fast light strong modern simple reliable battery steel cotton glass '
+    'wood screen power travel office home kitchen garden outdoor sport music photo energy eco '
+    'warranty delivery comfort premium storage wireless charge size colour set kit pack'
+).split()
+STREETS = ['Prager Str', 'Main St', 'Lindenallee', 'Baker St', 'Rue de Rivoli', 'Nevsky Ave']
+CITIES = ['Hanover', 'Berlin', 'London', 'Paris', 'Moscow', 'Kazan', 'Vienna', 'Prague']
+DISCOUNTS = [5, 10, 15, 20, 25, 30, 50]
+
+
+class Command(BaseCommand):
+    """
+    Fills the database with synthetic shop and blog data
+    """
+    help = "Generate users, products, orders and blog articles in bulk for performance testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=SIZES, default='small', help="Size preset of the generated data")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the random generator")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows inserted per query")
+        parser.add_argument('--password', default='password', help="Password of all generated users")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive")
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        counts = SIZES[options['size']]
+        self.stdout.write(f"Seed {options['size']} data set with seed {options['seed']}")
+
+        user_pks = self.step('users', self.create_users, counts['users'], options['password'])
+        product_pks, prices, discounts = self.step('products', self.create_products, counts['products'], user_pks)
+        self.step('orders', self.create_orders, counts['orders'], user_pks, product_pks, prices, discounts)
+        self.step('articles', self.create_articles, counts['articles'], user_pks)
+
+        # bulk_create does not send the signals maintaining the derived data
+        started = default_timer()
+        rebuild_index()
+        rebuild_catalog_stats()
+        bump_catalog_version()
+        build_sitemaps()
+        self.stdout.write(f"Rebuilt search index, catalog statistics and sitemaps in {default_timer() - started:.1f}s")
+        self.stdout.write(self.style.SUCCESS("Seeding finished"))
+
+    def step(self, name, create, count, *args):
+        started = default_timer()
+        result = create(count, *args)
+        elapsed = default_timer() - started
+        self.stdout.write(f"Created {count} {name} in {elapsed:.1f}s ({count / max(elapsed, 1e-6):.0f} rows/s)")
+        return result
+
+    def batches(self, count):
+        # Yields the (start, stop) index ranges of the insert batches
+        for start in range(0, count, self.batch_size):
+            yield start, min(start + self.batch_size, count)
+
+    def sentence(self, words):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+    def create_users(self, count, password):
+        # Hashing is slow on purpose, all users share one hash
+        hashed = make_password(password)
+        offset = User.objects.filter(username__startswith=USERNAME_PREFIX).count()
+        user_pks = array('q')
+        for start, stop in self.batches(count):
+            users = [
+                User(
+                    username=f'{USERNAME_PREFIX}{offset + number}',
+                    email=f'{USERNAME_PREFIX}{offset + number}@example.com',
+                    first_name=self.rng.choice(NOUNS),
+                    password=hashed,
+                    date_joined=self.now - timedelta(days=self.rng.randint(0, 1000)),
+                )
+                for number in range(start, stop)
+            ]
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+                Profile.objects.bulk_create([
+                    Profile(user_id=user.pk, bio=self.sentence(12), agreement_accepted=True)
+                    for user in users
+                ])
+            user_pks.extend(user.pk for user in users)
+        return user_pks
+
+    def create_products(self, count, user_pks):
+        # Prices are kept in cents in compact arrays, orders need them to compute their totals
+        product_pks, prices, discounts = array('q'), array('q'), array('b')
+        for start, stop in self.batches(count):
+            products = []
+            for number in range(start, stop):
+                price = Decimal(min(int(self.rng.lognormvariate(3.5, 1.2) * 100), 99_999_999)) / 100
+                products.append(Product(
+                    name=f'{self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS)} {number}',
+                    description=' '.join(self.sentence(self.rng.randint(6, 14)) for _ in range(3)),
+                    price=price,
+                    discount=self.rng.choice(DISCOUNTS) if self.rng.random() < 0.3 else 0,
+                    archived=self.rng.random() < 0.05,
+                    created_by_id=self.rng.choice(user_pks),
+                ))
+            with transaction.atomic():
+                Product.objects.bulk_create(products)
+            for product in products:
+                product_pks.append(product.pk)
+                prices.append(int(product.price * 100))
+                discounts.append(product.discount)
+        return product_pks, prices, discounts
+
+    def create_orders(self, count, user_pks, product_pks, prices, discounts):
+        if not product_pks:
+            return
+        through = Order.products.through
+        for start, stop in self.batches(count):
+            orders = []
+            items = []
+            for _ in range(start, stop):
+                indexes = self.rng.sample(range(len(product_pks)), min(self.rng.randint(1, 5), len(product_pks)))
+                order_prices = [(Decimal(prices[index]) / 100, discounts[index]) for index in indexes]
+                orders.append(Order(
+                    user_id=self.rng.choice(user_pks),
+                    delivery_address=(
+                        f'{self.rng.choice(CITIES)}, {self.rng.choice(STREETS)}, {self.rng.randint(1, 200)}'
+                    ),
+                    promocode=f'promo{self.rng.randint(1, 50)}' if self.rng.random() < 0.2 else '',
+                    items_count=len(indexes),
+                    total=sum(price for price, _ in order_prices),
+                    discounted_total=sum(discounted_price(price, discount) for price, discount in order_prices),
+                ))
+                items.append([product_pks[index] for index in indexes])
+            with transaction.atomic():
+                Order.objects.bulk_create(orders)
+                through.objects.bulk_create([
+                    through(order_id=order.pk, product_id=product_pk)
+                    for order, order_product_pks in zip(orders, items)
+                    for product_pk in order_product_pks
+                ])
+
+    def create_articles(self, count, user_pks):
+        if not count:
+            return
+        authors = [
+            Author(user_id=user_pk, bio=self.sentence(20))
+            for user_pk in self.rng.sample(list(user_pks), max(1, len(user_pks) // 10))
+        ]
+        categories = [Category(name=f'{noun} news') for noun in NOUNS]
+        tags = [Tag(name=f'{word}-{number}') for number in range(5) for word in WORDS]
+        with transaction.atomic():
+            Author.objects.bulk_create(authors)
+            Category.objects.bulk_create(categories)
+            Tag.objects.bulk_create(tags)
+
+        through = Article.tags.through
+        for start, stop in self.batches(count):
+            articles = [
+                Article(
+                    title=f'{self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS).lower()} review {number}',
+                    content='\n\n'.join(
+                        ' '.join(self.sentence(self.rng.randint(8, 20)) for _ in range(5))
+                        for _ in range(self.rng.randint(3, 8))
+                    ),
+                    pub_date=self.now - timedelta(minutes=self.rng.randint(0, 60 * 24 * 1000)),
+                    author_id=self.rng.choice(authors).pk,
+                    category_id=self.rng.choice(categories).pk,
+                )
+                for number in range(start, stop)
+            ]
+            for article in articles:
+                # bulk_create() does not call Article.save()
+                article.excerpt = article.content[:EXCERPT_LENGTH]
+            with transaction.atomic():
+                Article.objects.bulk_create(articles)
+                through.objects.bulk_create([
+                    through(article_id=article.pk, tag_id=tag.pk)
+                    for article in articles
+                    for tag in self.rng.sample(tags, self.rng.randint(0, 5))
+                ])
@@ -10,12 +10,9 @@ class Command(BaseCommand):
             self.stdout.write("no order found")
             return
 
-        products = Product.objects.all()
+        products = Product.objects.only('id').all()
 
-        for product in products:
-            order.products.add(product)
-
-        order.save()
+        order.products.add(*products)
 
         self.stdout.write(
             self.style.SUCCESS(
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.4 on 2026-10-18 19:11
+
+from django.db import migrations, models
+
+
+def fill_catalog_counters(apps, schema_editor):
+    from shopapp.stats import rebuild_catalog_stats
+
+    rebuild_catalog_stats(
+        product_model=apps.get_model('shopapp', 'Product'),
+        counter_model=apps.get_model('shopapp', 'CatalogCounter'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0016_cursor_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=40, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Catalog counter',
+                'verbose_name_plural': 'Catalog counters',
+            },
+        ),
+        migrations.RunPython(fill_catalog_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.4 on 2026-10-18 19:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_order_summaries(apps, schema_editor):
+    from shopapp.orders import rebuild_order_summaries
+
+    rebuild_order_summaries(order_model=apps.get_model('shopapp', 'Order'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0018_product_preview_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='discounted_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['total', 'id'], name='shopapp_ord_total_59db89_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['discounted_total', 'id'], name='shopapp_ord_discoun_4c0efa_idx'),
+        ),
+        migrations.RunPython(fill_order_summaries, migrations.RunPython.noop),
+    ]
@@ -3,6 +3,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.db import models
 from django.db.models.signals import post_migrate
 from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
@@ -30,15 +31,22 @@ class Product(models.Model):
         archived (BooleanField): The status of the product (archived or not).
         created_by (ForeignKey): The user who created the product.
         preview (ImageField): An optional preview image for the product.
+        preview_variants (JSONField): The resized copies of the preview, see ``shopapp.images``.
+        last_modified (DateTimeField): The date and time of the last change, also set by bulk updates.
 
     Meta:
         ordering (list): A list specifying the default ordering of products (by name and price).
         verbose_name (str): A verbose name for the model.
         verbose_name_plural (str): A verbose plural name for the model.
+        indexes (list): Composite indexes matching the orderings of the API.
 
     Methods:
         __str__(self) -> str:
             Returns a string representation of the product object.
+        preview_variant_urls(self) -> dict:
+            Returns the URLs of the resized preview variants by width.
+        preview_srcset(self) -> str:
+            Returns the preview variants as the value of a ``srcset`` attribute.
 
     """
 
@@ -46,19 +54,49 @@ class Product(models.Model):
         ordering = ["name", "price"]
         verbose_name = _("Product")
         verbose_name_plural = _("Products")
+        # Match the orderings of the API, pages are read in index order from the cursor position
+        indexes = [
+            models.Index(fields=["name", "price", "id"]),
+            models.Index(fields=["price", "id"]),
+        ]
 
     name = models.CharField(max_length=100, db_index=True)
-    description = models.TextField(null=False, blank=True, db_index=True)
+    description = models.TextField(null=False, blank=True)
     price = models.DecimalField(default=0, max_digits=8, decimal_places=2)
     discount = models.SmallIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     archived = models.BooleanField(default=False)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     preview = models.ImageField(upload_to=product_preview_image, null=True, blank=True)
+    preview_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # Bulk updates bypass auto_now and set it themselves, see shopapp.common.update_products
+    last_modified = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"Product(pk={self.pk}, name={self.name!r})"
 
+    def preview_variant_urls(self) -> dict:
+        """
+        Return the URLs of the resized preview variants by width.
+        Empty while the variants of the current preview are not rendered yet.
+        """
+        if not self.preview or self.preview_variants.get('source') != self.preview.name:
+            return {}
+        storage = self.preview.storage
+        return {
+            int(width): storage.url(name)
+            for width, name in self.preview_variants['widths'].items()
+        }
+
+    def preview_srcset(self) -> str:
+        """
+        Return the preview variants in the format of the ``srcset`` attribute of ``<img>``.
+        """
+        return ", ".join(
+            f"{url} {width}w"
+            for width, url in sorted(self.preview_variant_urls().items())
+        )
+
 
 class Order(models.Model):
     """
@@ -81,10 +119,28 @@ class Order(models.Model):
 
     :param receipt: The receipt file associated with the order. (optional)
     :type receipt: File or None
+
+    :param items_count: The number of products in the order, kept in sync by signals.
+    :type items_count: int
+
+    :param total: The sum of the product prices, kept in sync by signals.
+    :type total: decimal.Decimal
+
+    :param discounted_total: The sum of the product prices after their discounts, kept in sync by signals.
+    :type discounted_total: decimal.Decimal
+
+    :param last_modified: The date and time of the last change, also set when the summary is refreshed.
+    :type last_modified: datetime.datetime
     """
     class Meta:
         verbose_name = _("Order")
         verbose_name_plural = _("Orders")
+        # Matches the ordering of the API, newest orders first
+        indexes = [
+            models.Index(fields=["created_at", "id"]),
+            models.Index(fields=["total", "id"]),
+            models.Index(fields=["discounted_total", "id"]),
+        ]
 
     delivery_address = models.TextField(null=True, blank=True)
     promocode = models.CharField(max_length=20, null=False, blank=True)
@@ -92,6 +148,109 @@ class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.PROTECT)
     products = models.ManyToManyField(Product, related_name="orders")
     receipt = models.FileField(null=True, upload_to="orders/receipts")
+    items_count = models.PositiveIntegerField(default=0, editable=False)
+    total = models.DecimalField(default=0, max_digits=12, decimal_places=2, editable=False)
+    discounted_total = models.DecimalField(default=0, max_digits=12, decimal_places=2, editable=False)
+    last_modified = models.DateTimeField(auto_now=True, db_index=True)
+
+
+class ProductImportJob(models.Model):
+    """
+    A CSV file with products waiting to be imported by the import worker.
+
+    The upload is stored on disk by the API and the ``run_import_worker``
+    management command picks queued jobs up, updating the counters while
+    the file is processed.
+
+    :param file: The uploaded CSV file.
+    :param encoding: The encoding of the CSV file.
+    :param status: The state of the job (queued, running, done or failed).
+    :param created_by: The user who uploaded the file, becomes the author of the products.
+    :param rows_read: The number of CSV rows processed so far.
+    :param inserted: The number of products created so far.
+    :param rejected: The number of rows rejected by validation so far.
+    :param bytes_read: The number of bytes of the file processed so far.
+    :param errors: The first validation errors with their line numbers.
+    :param error: The reason why the job failed.
+    """
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, _("Queued")),
+        (STATUS_RUNNING, _("Running")),
+        (STATUS_DONE, _("Done")),
+        (STATUS_FAILED, _("Failed")),
+    ]
+
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name = _("Product import job")
+        verbose_name_plural = _("Product import jobs")
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+        ]
+
+    file = models.FileField(upload_to="imports/products")
+    encoding = models.CharField(max_length=40, default="utf-8")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    rows_read = models.PositiveIntegerField(default=0)
+    inserted = models.PositiveIntegerField(default=0)
+    rejected = models.PositiveIntegerField(default=0)
+    bytes_total = models.PositiveBigIntegerField(default=0)
+    bytes_read = models.PositiveBigIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True)
+
+    @property
+    def progress(self) -> float:
+        """Share of the file processed so far, from 0 to 1."""
+        if self.status == self.STATUS_DONE:
+            return 1.0
+        if not self.bytes_total:
+            return 0.0
+        return min(self.bytes_read / self.bytes_total, 1.0)
+
+    @property
+    def rows_per_second(self) -> float:
+        """Import throughput since the job was started."""
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at or timezone.now()
+        elapsed = (end - self.started_at).total_seconds()
+        if elapsed <= 0:
+            return 0.0
+        return round(self.rows_read / elapsed, 1)
+
+    def __str__(self):
+        return f"ProductImportJob(pk={self.pk}, status={self.status!r})"
+
+
+class CatalogCounter(models.Model):
+    """
+    A named counter of the catalog statistics, e.g. the number of archived
+    products or of products in a price range.
+
+    The counters are updated incrementally whenever products change,
+    see ``shopapp.stats``.
+
+    :param name: The name of the counter.
+    :param value: The current value of the counter.
+    """
+    class Meta:
+        verbose_name = _("Catalog counter")
+        verbose_name_plural = _("Catalog counters")
+
+    name = models.CharField(max_length=40, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"CatalogCounter(name={self.name!r}, value={self.value})"
 
 
 @receiver(post_migrate)
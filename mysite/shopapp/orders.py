@@ -0,0 +1,107 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order
+
+# Order summaries are computed and written in batches of this many orders
+SUMMARY_BATCH_SIZE = 1000
+
+# Order columns holding the denormalized summary of its products
+SUMMARY_FIELDS = ['items_count', 'total', 'discounted_total']
+
+CENT = Decimal('0.01')
+
+
+def discounted_price(price, discount) -> Decimal:
+    """
+    Apply a discount in percent to a price, rounded to cents.
+    """
+    discount = min(max(int(discount or 0), 0), 100)
+    price = Decimal(str(price or 0))
+    return (price * (100 - discount) / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def compute_summaries(order_pks, order_model=Order) -> dict:
+    """
+    Compute the summary of the given orders from the prices of their products.
+
+    :param order_pks: The primary keys of the orders.
+    :param order_model: The order model, migrations pass the historical one.
+    :return: A dict mapping each order pk to (items_count, total, discounted_total).
+    """
+    summaries = {pk: [0, Decimal('0.00'), Decimal('0.00')] for pk in order_pks}
+    items = (
+        order_model.products.through.objects
+        .filter(order_id__in=summaries)
+        .values_list('order_id', 'product__price', 'product__discount')
+    )
+    for order_pk, price, discount in items:
+        summary = summaries[order_pk]
+        summary[0] += 1
+        summary[1] += Decimal(str(price)).quantize(CENT)
+        summary[2] += discounted_price(price, discount)
+    return {pk: tuple(summary) for pk, summary in summaries.items()}
+
+
+def refresh_order_summaries(order_pks, batch_size=SUMMARY_BATCH_SIZE, order_model=Order) -> int:
+    """
+    Write the summary columns of the given orders again.
+
+    :param order_pks: The primary keys of the orders.
+    :param batch_size: The number of orders computed and updated per query.
+    :param order_model: The order model, migrations pass the historical one.
+    :return: The number of refreshed orders.
+    """
+    order_pks = sorted(set(order_pks))
+    fields = list(SUMMARY_FIELDS)
+    extra = {}
+    try:
+        # bulk_update() skips auto_now, older historical models have no such field
+        order_model._meta.get_field('last_modified')
+    except FieldDoesNotExist:
+        pass
+    else:
+        fields.append('last_modified')
+        extra['last_modified'] = timezone.now()
+    for start in range(0, len(order_pks), batch_size):
+        summaries = compute_summaries(order_pks[start:start + batch_size], order_model)
+        orders = [
+            order_model(pk=pk, items_count=items_count, total=total, discounted_total=discounted_total, **extra)
+            for pk, (items_count, total, discounted_total) in summaries.items()
+        ]
+        with transaction.atomic():
+            order_model.objects.bulk_update(orders, fields)
+    return len(order_pks)
+
+
+def refresh_product_orders(product_pks, batch_size=SUMMARY_BATCH_SIZE) -> int:
+    """
+    Refresh the summaries of every order containing one of the given products,
+    e.g. after their price or discount changed.
+
+    :param product_pks: The primary keys of the changed products.
+    :return: The number of refreshed orders.
+    """
+    order_pks = (
+        Order.products.through.objects
+        .filter(product_id__in=list(product_pks))
+        .values_list('order_id', flat=True)
+        .distinct()
+    )
+    return refresh_order_summaries(order_pks, batch_size)
+
+
+def rebuild_order_summaries(batch_size=SUMMARY_BATCH_SIZE, order_model=Order) -> int:
+    """
+    Compute the summaries of all orders again.
+
+    :param batch_size: The number of orders computed and updated per query.
+    :param order_model: The order model, migrations pass the historical one.
+    :return: The number of orders.
+    """
+    order_pks = order_model.objects.order_by().values_list('pk', flat=True)
+    return refresh_order_summaries(order_pks, batch_size, order_model)
+
@@ -0,0 +1,182 @@
+import json
+from base64 import b64decode, b64encode
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination over the view ordering with the pk as a tiebreaker.
+
+    The cursor holds the values of all ordering fields of the last (or, going
+    back, the first) row of a page, and the next page is read with
+    ``WHERE (f1, f2, pk) > (v1, v2, pk) ORDER BY f1, f2, pk LIMIT n``,
+    expanded to ``f1 > v1 OR (f1 = v1 AND f2 > v2) OR ...`` for SQLite.
+    With an index on the ordering every page costs the same, however many
+    rows come before it or tie on the first fields. The ordering fields must
+    not be nullable. The total count is skipped unless the client asks for
+    it with ``?count=true``.
+
+    The ordering comes from the ``OrderingFilter`` of the view (``?ordering=``)
+    and defaults to ``ordering`` of the pagination class. Searches through the
+    product full-text index are ordered by relevance.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    count_query_param = 'count'
+    ordering = ('pk',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = queryset.count()
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+        values, reverse = self.decode_cursor(request, queryset.model)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self.after(ordering, values))
+
+        # One row more than the page tells if there is another page in this direction
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+        return self.page
+
+    def after(self, ordering, values) -> Q:
+        """
+        Build the row comparison ``(f1, f2, ...) > (v1, v2, ...)`` in the direction of each field.
+        """
+        conditions = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {other.lstrip('-'): value for other, value in zip(ordering[:index], values)}
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': values[index]}))
+        return reduce(or_, conditions)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, instance, reverse):
+        data = {'v': [getattr(instance, field) for field in self.fields], 'r': int(reverse)}
+        encoded = b64encode(json.dumps(data, cls=DjangoJSONEncoder).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request, model=None):
+        """
+        Return the ordering values of the cursor, converted to the field types,
+        and whether it points backwards. ``(None, False)`` for the first page.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            data = json.loads(b64decode(encoded.encode(), validate=True))
+            values, reverse = data['v'], bool(data['r'])
+            # A cursor of another ordering
+            if len(values) != len(self.fields):
+                raise ValueError(encoded)
+            values = [self.to_python(model, field, value) for field, value in zip(self.fields, values)]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def to_python(self, model, name, value):
+        if name == 'pk':
+            return model._meta.pk.to_python(value)
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Annotations like search_rank, which JSON keeps as numbers
+            return value
+        return field.to_python(value)
+
+    def get_ordering(self, request, queryset, view):
+        if 'search_rank' in queryset.query.annotations and not request.query_params.get('ordering'):
+            return ('search_rank', 'pk')
+
+        ordering = None
+        ordering_filters = [
+            backend for backend in getattr(view, 'filter_backends', [])
+            if hasattr(backend, 'get_ordering')
+        ]
+        if ordering_filters:
+            ordering = ordering_filters[0]().get_ordering(request, queryset, view)
+        ordering = tuple(ordering or self.ordering)
+        # Rows with the same value in the ordering fields need a stable order
+        if not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+            direction = '-' if ordering[0].startswith('-') else ''
+            ordering += (direction + 'pk',)
+        return ordering
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data['count'] = self.count
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        schema = super().get_paginated_response_schema(schema)
+        schema['properties']['count'] = {
+            'type': 'integer',
+            'description': 'Total number of results, only returned with ?count=true',
+        }
+        return schema
+
+
+class ProductCursorPagination(KeysetCursorPagination):
+    ordering = ('name', 'price', 'pk')
+
+
+class OrderCursorPagination(KeysetCursorPagination):
+    ordering = ('-created_at', '-pk')
+
+
+class CountedPaginator(Paginator):
+    """
+    A ``Paginator`` using a known number of objects instead of running ``COUNT(*)``.
+
+    :param count: The number of objects, e.g. read from the catalog counters.
+    """
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, count=None):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.known_count = count
+
+    @property
+    def count(self):
+        if self.known_count is None:
+            return super().count
+        return self.known_count
@@ -0,0 +1,157 @@
+import re
+
+from django.db import connection
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+from .models import Product
+
+# SQLite FTS5 table holding a copy of the searchable product fields, the rowid is the product pk
+FTS_TABLE = 'shopapp_product_fts'
+
+# bm25 weights of the indexed columns, a match in the name counts more than in the description
+FTS_WEIGHTS = '10.0, 1.0'
+
+# Products are read from the database in chunks of this size while rebuilding the index
+REBUILD_CHUNK_SIZE = 2000
+
+
+def is_search_available() -> bool:
+    """
+    Check whether the full-text index can be used with the current database.
+
+    :return: True for SQLite, other databases fall back to ``icontains`` lookups.
+    """
+    return connection.vendor == 'sqlite'
+
+
+def index_products(rows):
+    """
+    Add or replace products in the full-text index.
+
+    :param rows: An iterable of (pk, name, description) tuples.
+    """
+    rows = list(rows)
+    if not rows or not is_search_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"DELETE FROM {FTS_TABLE} WHERE rowid = %s",
+            [(pk,) for pk, _, _ in rows],
+        )
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (%s, %s, %s)",
+            rows,
+        )
+
+
+def reindex_products(pks):
+    """
+    Copy the current name and description of the given products into the index.
+
+    :param pks: The primary keys of the changed products.
+    """
+    pks = list(pks)
+    if not is_search_available():
+        return
+    remove_products(pks)
+    index_products(Product.objects.filter(pk__in=pks).values_list('pk', 'name', 'description'))
+
+
+def remove_products(pks):
+    """
+    Remove products from the full-text index.
+
+    :param pks: The primary keys of the removed products.
+    """
+    pks = list(pks)
+    if not pks or not is_search_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"DELETE FROM {FTS_TABLE} WHERE rowid = %s",
+            [(pk,) for pk in pks],
+        )
+
+
+def rebuild_index(chunk_size=REBUILD_CHUNK_SIZE) -> int:
+    """
+    Drop the content of the full-text index and fill it again from the product table.
+
+    :param chunk_size: The number of products indexed per query.
+    :return: The number of indexed products.
+    """
+    if not is_search_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+    count = 0
+    chunk = []
+    rows = Product.objects.order_by().values_list('pk', 'name', 'description').iterator(chunk_size=chunk_size)
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            index_products(chunk)
+            count += len(chunk)
+            chunk = []
+    index_products(chunk)
+    return count + len(chunk)
+
+
+def build_match_query(terms: str) -> str:
+    """
+    Turn user input into an FTS5 query: every word has to match as a prefix.
+
+    Words are quoted, so FTS5 operators typed by the user are matched literally.
+
+    :param terms: The search string entered by the user.
+    :return: The FTS5 MATCH expression, empty when there is nothing to search for.
+    """
+    words = re.findall(r'\w+', terms)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_products(queryset, terms: str):
+    """
+    Filter a product queryset with the full-text index.
+
+    The products are annotated with ``search_rank`` (bm25, lower is more relevant)
+    and ordered by it.
+
+    :param queryset: A Product queryset.
+    :param terms: The search string entered by the user.
+    :return: The filtered and ranked queryset.
+    """
+    match = build_match_query(terms)
+    if not match:
+        return queryset
+    table = Product._meta.db_table
+    rank = RawSQL(
+        f"SELECT bm25({FTS_TABLE}, {FTS_WEIGHTS}) FROM {FTS_TABLE} "
+        f"WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {table}.id",
+        [match],
+        output_field=FloatField(),
+    )
+    matches = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match])
+    return (
+        queryset
+        .filter(pk__in=matches)
+        .annotate(search_rank=rank)
+        .order_by('search_rank', 'pk')
+    )
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    A ``SearchFilter`` using the product full-text index, most relevant products first.
+
+    Falls back to the default ``icontains`` search over ``search_fields``
+    when the index is not available.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms or not is_search_available():
+            return super().filter_queryset(request, queryset, view)
+        return search_products(queryset, ' '.join(terms))
@@ -1,14 +1,83 @@
+from django.contrib.auth.models import User
 from rest_framework import serializers, viewsets
-from .models import Product, Order
+from .models import Product, Order, ProductImportJob
 
 
 class ProductSerializer(serializers.ModelSerializer):
+    preview_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Product
         fields = '__all__'
 
+    def get_preview_variants(self, obj: Product) -> dict:
+        # Resized copies of the preview by width, clients pick the one matching their screen
+        request = self.context.get('request')
+        urls = obj.preview_variant_urls()
+        if request is not None:
+            urls = {width: request.build_absolute_uri(url) for width, url in urls.items()}
+        return urls
+
 
 class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = '__all__'
+
+
+class ProductSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'price', 'discount']
+
+
+class OrderUserSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'first_name', 'last_name']
+
+
+class OrderReadSerializer(serializers.ModelSerializer):
+    """
+    Read-only order representation with the user and product summaries nested.
+
+    Expects the queryset of ``OrderViewSet``, which loads the users with
+    ``select_related`` and the products with one ``prefetch_related`` query.
+    """
+    user = OrderUserSerializer(read_only=True)
+    products = ProductSummarySerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = [
+            'id', 'user', 'products', 'delivery_address', 'promocode', 'created_at', 'receipt',
+            'items_count', 'total', 'discounted_total',
+        ]
+        read_only_fields = fields
+
+
+class ProductImportJobSerializer(serializers.ModelSerializer):
+    progress = serializers.FloatField(read_only=True)
+    rows_per_second = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = ProductImportJob
+        fields = [
+            'id', 'status', 'progress', 'rows_per_second',
+            'rows_read', 'inserted', 'rejected', 'errors', 'error',
+            'created_at', 'started_at', 'finished_at',
+        ]
+        read_only_fields = fields
+
+
+class OrderBulkItemSerializer(serializers.Serializer):
+    """
+    One order of a bulk creation request.
+
+    Users and products are plain primary keys here, their existence is checked
+    for the whole batch at once by ``common.create_orders``.
+    """
+    user = serializers.IntegerField(min_value=1, required=False)
+    delivery_address = serializers.CharField(required=False, allow_blank=True, allow_null=True, default=None)
+    promocode = serializers.CharField(max_length=20, required=False, allow_blank=True, default='')
+    products = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False)
@@ -0,0 +1,203 @@
+from collections import Counter
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, pre_delete, pre_save, post_save, post_delete
+from django.dispatch import receiver, Signal
+from django.utils import timezone
+
+from . import images, orders, search, stats
+from .cache import bump_catalog_version, bump_product_versions
+from .models import Order, Product
+
+# Sent after products were changed without Model.save(), e.g. by bulk_create()
+# or QuerySet.update(). Arguments: pks (list of product pks),
+# fields (names of the changed fields, None when unknown) and
+# previous (stats.count_products() of the products before the change,
+# None for newly created products).
+products_changed = Signal()
+
+
+# Product.objects.bulk_create() and QuerySet.update() send no post_save, their
+# rows only reach the full-text index (and the other derived data) when the
+# caller sends products_changed like save_csv_products() does, or rebuilds the
+# index afterwards like seed_data and the rebuild_product_search command do.
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance: Product, **kwargs):
+    """
+    Keep the full-text index in sync with a saved product.
+    """
+    search.index_products([(instance.pk, instance.name, instance.description)])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance: Product, **kwargs):
+    """
+    Remove a deleted product from the full-text index.
+    """
+    search.remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(products_changed)
+def invalidate_catalog_cache(sender, **kwargs):
+    """
+    Drop the cached catalog responses when any product changes.
+
+    Bumped after the commit, otherwise a concurrent request could cache the
+    old data under the new version.
+    """
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_fragments(sender, instance: Product, **kwargs):
+    """
+    Drop the cached fragments of a saved or deleted product.
+    """
+    pk = instance.pk
+    transaction.on_commit(lambda: bump_product_versions([pk]))
+
+
+@receiver(products_changed)
+def invalidate_changed_product_fragments(sender, pks, **kwargs):
+    """
+    Drop the cached fragments of products changed in bulk.
+    """
+    transaction.on_commit(lambda: bump_product_versions(pks))
+
+
+@receiver(products_changed)
+def reindex_changed_products(sender, pks, fields=None, **kwargs):
+    """
+    Keep the full-text index in sync with products changed in bulk.
+    """
+    if fields is not None and not {'name', 'description'} & set(fields):
+        return
+    search.reindex_products(pks)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_counters(sender, instance: Product, raw=False, **kwargs):
+    """
+    Count the stored state of a product before it is overwritten.
+    """
+    instance._catalog_counters = Counter()
+    instance._stored_pricing = None
+    if not raw and not instance._state.adding and instance.pk is not None:
+        stored = Product.objects.only('archived', 'price', 'discount').filter(pk=instance.pk).first()
+        if stored is not None:
+            instance._catalog_counters = stats.product_counters(stored)
+            instance._stored_pricing = (stored.price, stored.discount)
+
+
+@receiver(post_save, sender=Product)
+def update_stats_for_saved_product(sender, instance: Product, **kwargs):
+    """
+    Move a saved product to its new catalog counters.
+    """
+    before = getattr(instance, '_catalog_counters', Counter())
+    stats.apply_deltas(stats.subtract(stats.product_counters(instance), before))
+
+
+@receiver(post_delete, sender=Product)
+def update_stats_for_deleted_product(sender, instance: Product, **kwargs):
+    """
+    Remove a deleted product from its catalog counters.
+    """
+    stats.apply_deltas(stats.subtract(Counter(), stats.product_counters(instance)))
+
+
+@receiver(products_changed)
+def update_stats_for_changed_products(sender, pks, fields=None, previous=None, **kwargs):
+    """
+    Apply the counter changes of products created or updated in bulk.
+    """
+    if fields is not None and not {'archived', 'price', 'discount'} & set(fields):
+        return
+    after = stats.count_products(Product.objects.filter(pk__in=pks))
+    stats.apply_deltas(stats.subtract(after, previous or Counter()))
+
+
+@receiver(post_save, sender=Product)
+def render_preview_variants(sender, instance: Product, raw=False, **kwargs):
+    """
+    Render the resized variants of a new preview image, see ``images.schedule_preview_variants``.
+    """
+    if raw:
+        return
+    if not instance.preview:
+        if instance.preview_variants:
+            Product.objects.filter(pk=instance.pk).update(preview_variants={}, last_modified=timezone.now())
+        return
+    if instance.preview_variants.get('source') != instance.preview.name:
+        images.schedule_preview_variants(instance)
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def update_summaries_for_order_items(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Refresh the order summaries when products are added to or removed from orders.
+    """
+    if reverse:
+        # product.orders was changed, pk_set holds order pks
+        if action == 'pre_clear':
+            instance._cleared_order_pks = list(instance.orders.values_list('pk', flat=True))
+        elif action == 'post_clear':
+            orders.refresh_order_summaries(getattr(instance, '_cleared_order_pks', []))
+        elif action in ('post_add', 'post_remove'):
+            orders.refresh_order_summaries(pk_set)
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        orders.refresh_order_summaries([instance.pk])
+
+
+@receiver(post_save, sender=Order.products.through)
+@receiver(post_delete, sender=Order.products.through)
+def update_summaries_for_order_item(sender, instance, raw=False, **kwargs):
+    """
+    Refresh the summary of an order whose item was saved or deleted directly,
+    e.g. through the inline of the order admin.
+    """
+    if not raw:
+        orders.refresh_order_summaries([instance.order_id])
+
+
+@receiver(post_save, sender=Product)
+def update_summaries_for_saved_product(sender, instance: Product, created=False, raw=False, **kwargs):
+    """
+    Refresh the summaries of the orders containing a product whose price or discount changed.
+    """
+    stored = getattr(instance, '_stored_pricing', None)
+    if created or raw or stored is None:
+        return
+    if (Decimal(str(instance.price)), int(instance.discount)) == (stored[0], stored[1]):
+        return
+    orders.refresh_product_orders([instance.pk])
+
+
+@receiver(pre_delete, sender=Product)
+def remember_product_orders(sender, instance: Product, **kwargs):
+    """
+    Remember the orders of a product before the deletion removes it from them.
+    """
+    instance._order_pks = list(instance.orders.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Product)
+def update_summaries_for_deleted_product(sender, instance: Product, **kwargs):
+    """
+    Refresh the summaries of the orders a deleted product was removed from.
+    """
+    orders.refresh_order_summaries(getattr(instance, '_order_pks', []))
+
+
+@receiver(products_changed)
+def update_summaries_for_changed_products(sender, pks, fields=None, **kwargs):
+    """
+    Refresh the order summaries after product prices or discounts were changed in bulk.
+    """
+    if fields is not None and not {'price', 'discount'} & set(fields):
+        return
+    orders.refresh_product_orders(pks)
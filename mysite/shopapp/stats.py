@@ -0,0 +1,163 @@
+from collections import Counter
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Value, When
+
+from .models import CatalogCounter, Product
+
+# Upper bounds of the price ranges, the last range has no upper bound
+PRICE_BUCKETS = [10, 50, 100, 500, 1000]
+
+# Upper bounds (inclusive) of the discount ranges in percent, the last range has no upper bound
+DISCOUNT_BUCKETS = [0, 10, 25, 50]
+
+
+def bucket_labels(bounds, inclusive):
+    labels = []
+    lower = 0
+    for upper in bounds:
+        if inclusive:
+            labels.append(str(upper) if lower == upper else f'{lower}-{upper}')
+            lower = upper + 1
+        else:
+            labels.append(f'{lower}-{upper}')
+            lower = upper
+    labels.append(f'{lower}+')
+    return labels
+
+
+PRICE_LABELS = bucket_labels(PRICE_BUCKETS, inclusive=False)
+DISCOUNT_LABELS = bucket_labels(DISCOUNT_BUCKETS, inclusive=True)
+
+
+def bucket_expression(field, lookup, bounds, labels):
+    """
+    Build a CASE expression returning the label of the range the field value falls in.
+    """
+    return Case(
+        *[
+            When(**{f'{field}__{lookup}': upper}, then=Value(label))
+            for upper, label in zip(bounds, labels)
+        ],
+        default=Value(labels[-1]),
+    )
+
+
+def price_label(price) -> str:
+    price = Decimal(str(price))
+    for upper, label in zip(PRICE_BUCKETS, PRICE_LABELS):
+        if price < upper:
+            return label
+    return PRICE_LABELS[-1]
+
+
+def discount_label(discount) -> str:
+    discount = int(discount)
+    for upper, label in zip(DISCOUNT_BUCKETS, DISCOUNT_LABELS):
+        if discount <= upper:
+            return label
+    return DISCOUNT_LABELS[-1]
+
+
+def product_counters(product) -> Counter:
+    """
+    Return the catalog counters a single product instance contributes to.
+
+    :param product: A Product instance.
+    :return: A Counter mapping counter names to 1 (or 0).
+    """
+    return Counter({
+        'total': 1,
+        'archived': int(bool(product.archived)),
+        f'price:{price_label(product.price)}': 1,
+        f'discount:{discount_label(product.discount)}': 1,
+    })
+
+
+def count_products(queryset) -> Counter:
+    """
+    Count the products of a queryset per catalog counter with one grouped query.
+
+    :param queryset: A Product queryset.
+    :return: A Counter mapping counter names to the number of products.
+    """
+    rows = (
+        queryset
+        .order_by()
+        .annotate(
+            price_bucket=bucket_expression('price', 'lt', PRICE_BUCKETS, PRICE_LABELS),
+            discount_bucket=bucket_expression('discount', 'lte', DISCOUNT_BUCKETS, DISCOUNT_LABELS),
+        )
+        .values('archived', 'price_bucket', 'discount_bucket')
+        .annotate(products=Count('pk'))
+    )
+    counters = Counter()
+    for row in rows:
+        counters['total'] += row['products']
+        if row['archived']:
+            counters['archived'] += row['products']
+        counters[f"price:{row['price_bucket']}"] += row['products']
+        counters[f"discount:{row['discount_bucket']}"] += row['products']
+    return counters
+
+
+def apply_deltas(deltas, counter_model=CatalogCounter):
+    """
+    Add the given deltas to the stored counters.
+
+    :param deltas: A mapping of counter names to the values to add.
+    :param counter_model: The counter model, migrations pass the historical one.
+    """
+    with transaction.atomic():
+        for name, delta in deltas.items():
+            if not delta:
+                continue
+            counters = counter_model.objects.filter(name=name)
+            if counters.update(value=F('value') + delta):
+                continue
+            try:
+                # A concurrent transaction may create the same counter first
+                with transaction.atomic():
+                    counter_model.objects.create(name=name, value=delta)
+            except IntegrityError:
+                counters.update(value=F('value') + delta)
+
+
+def subtract(after: Counter, before: Counter) -> dict:
+    return {name: after[name] - before[name] for name in set(after) | set(before)}
+
+
+def rebuild_catalog_stats(product_model=Product, counter_model=CatalogCounter):
+    """
+    Compute all counters again from the product table.
+
+    :param product_model: The product model, migrations pass the historical one.
+    :param counter_model: The counter model, migrations pass the historical one.
+    """
+    counters = count_products(product_model.objects.all())
+    with transaction.atomic():
+        counter_model.objects.all().delete()
+        counter_model.objects.bulk_create([
+            counter_model(name=name, value=value)
+            for name, value in counters.items()
+        ])
+
+
+def get_catalog_stats() -> dict:
+    """
+    Read the catalog statistics from the counters, without scanning the product table.
+
+    :return: A dict with the total, active and archived product counts and
+        the number of products per price and discount range.
+    """
+    values = dict(CatalogCounter.objects.values_list('name', 'value'))
+    total = values.get('total', 0)
+    archived = values.get('archived', 0)
+    return {
+        'total': total,
+        'active': total - archived,
+        'archived': archived,
+        'price': {label: values.get(f'price:{label}', 0) for label in PRICE_LABELS},
+        'discount': {label: values.get(f'discount:{label}', 0) for label in DISCOUNT_LABELS},
+    }
@@ -1,17 +1,50 @@
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from io import BytesIO, StringIO
 from random import choices
 from string import ascii_letters
+from unittest import mock
 
 from django.contrib.auth.mixins import UserPassesTestMixin
 from django.contrib.auth.models import User, Permission
-from django.http import request, JsonResponse
-from django.test import TestCase
+from django.http import request, HttpResponse, JsonResponse
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.http import http_date
 from django.views import View
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from blogapp.models import Article
+from shopapp.cache import get_catalog_cache_stats, get_catalog_version
+from shopapp.management.commands.benchmark_routes import find_regressions, percentile
+from shopapp.common import save_csv_products, update_products
+from shopapp.orders import compute_summaries
+from shopapp.pagination import ProductCursorPagination
+from shopapp.search import search_products
+from shopapp.signals import products_changed
+from shopapp.stats import apply_deltas, get_catalog_stats, rebuild_catalog_stats
 from shopapp.utils import add_two_numbers
 
-from shopapp.models import Product, Order
+from shopapp.models import CatalogCounter, Product, Order, ProductImportJob
 
-from mysite import settings
+from mysite import cache_backends, caching, log_handlers, sampling, settings
+from mysite.metrics import registry as metrics_registry
+from mysite.middleware import RequestMetrics, current_metrics
 
 
 class AddTwoNumbersTestCase(TestCase):
@@ -162,3 +195,941 @@ class TestView(TestCase):
         response = self.client.get(reverse('shopapp:example_url'))
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "This is an example view.")
+
+
+class ProductDownloadCSVTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='csv_test', password='qwerty')
+        products = Product.objects.bulk_create([
+            Product(name='Laptop', description='Light laptop', price='999.00', discount=5, created_by=cls.user),
+            Product(name='Desktop', description='Big desktop', price='1999.00', discount=0, created_by=cls.user),
+        ])
+        # bulk_create() sends no post_save, the products reach the search index through products_changed
+        products_changed.send(sender=Product, pks=[product.pk for product in products])
+
+    def test_download_csv_is_streamed(self):
+        response = self.client.get(reverse('shopapp:products-download-csv'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        lines = content.splitlines()
+        self.assertEqual(lines[0], 'name,description,price,discount')
+        self.assertEqual(len(lines), 3)
+
+    def test_download_csv_honours_search(self):
+        response = self.client.get(reverse('shopapp:products-download-csv'), {'search': 'laptop'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[1:], ['Laptop,Light laptop,999.00,5'])
+
+
+class SaveCSVProductsTestCase(TestCase):
+    csv_data = (
+        'name,description,price,discount\n'
+        'Laptop,Light laptop,999.00,5\n'
+        'Desktop,Big desktop,not-a-price,0\n'
+        'Phone,Small phone,499.00,10\n'
+    ).encode()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='import_test', password='qwerty')
+
+    def test_invalid_rows_are_rejected(self):
+        summary = save_csv_products(BytesIO(self.csv_data), encoding='utf-8', created_by=self.user, batch_size=1)
+        self.assertEqual(summary['rows_read'], 3)
+        self.assertEqual(summary['inserted'], 2)
+        self.assertEqual(summary['rejected'], 1)
+        self.assertEqual(summary['errors'][0]['line'], 3)
+        self.assertIn('price', summary['errors'][0]['errors'])
+        self.assertEqual(Product.objects.filter(created_by=self.user).count(), 2)
+
+    def test_upload_csv_enqueues_import_job(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        upload = BytesIO(self.csv_data)
+        upload.name = 'products.csv'
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            response = client.post(reverse('shopapp:products-upload-csv'), {'file': upload}, format='multipart')
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.json()['status'], ProductImportJob.STATUS_QUEUED)
+            self.assertFalse(Product.objects.filter(created_by=self.user).exists())
+
+            call_command('run_import_worker', '--once', stdout=StringIO())
+
+        response = client.get(response['Location'])
+        self.assertEqual(response.json()['status'], ProductImportJob.STATUS_DONE)
+        self.assertEqual(response.json()['inserted'], 2)
+        self.assertEqual(response.json()['rejected'], 1)
+        self.assertEqual(response.json()['progress'], 1.0)
+
+
+class ProductSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='search_test', password='qwerty')
+        cls.laptop = Product.objects.create(name='Gaming laptop', description='Fast', created_by=cls.user)
+        cls.bag = Product.objects.create(name='Bag', description='A bag for your laptop', created_by=cls.user)
+        Product.objects.create(name='Desktop', description='Tower', created_by=cls.user)
+
+    def search(self, term):
+        response = self.client.get(reverse('shopapp:products-list'), {'search': term})
+        return [product['name'] for product in response.json()['results']]
+
+    def test_search_ranks_name_matches_first(self):
+        self.assertEqual(self.search('lapt'), ['Gaming laptop', 'Bag'])
+
+    def test_search_results_are_paginated_by_relevance(self):
+        url = reverse('shopapp:products-list') + '?search=laptop&page_size=1'
+        names = []
+        while url:
+            data = self.client.get(url).json()
+            names.extend(product['name'] for product in data['results'])
+            url = data['next']
+        self.assertEqual(names, ['Gaming laptop', 'Bag'])
+
+    def test_search_index_follows_changes(self):
+        self.bag.name = 'Backpack'
+        self.bag.description = 'Waterproof'
+        self.bag.save()
+        self.laptop.delete()
+        self.assertEqual(self.search('laptop'), [])
+        self.assertEqual(self.search('waterproof'), ['Backpack'])
+
+    def test_bulk_created_products_are_indexed_by_products_changed(self):
+        products = Product.objects.bulk_create([
+            Product(name='Lamp', description='Desk lamp', created_by=self.user),
+        ])
+        # Not indexed by bulk_create() itself
+        self.assertEqual(self.search('lamp'), [])
+        # The cached catalog responses are dropped after the commit
+        with self.captureOnCommitCallbacks(execute=True):
+            products_changed.send(sender=Product, pks=[product.pk for product in products])
+        self.assertEqual(self.search('lamp'), ['Lamp'])
+
+
+class ProductCursorPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='pagination_test', password='qwerty')
+        for name, price in [('Cable', 5), ('Adapter', 10), ('Adapter', 10), ('Battery', 7)]:
+            Product.objects.create(name=name, price=price, created_by=cls.user)
+
+    def test_pages_follow_ordering_with_pk_tiebreaker(self):
+        url = reverse('shopapp:products-list') + '?page_size=2'
+        seen = []
+        while url:
+            data = self.client.get(url).json()
+            self.assertNotIn('count', data)
+            seen.extend(product['id'] for product in data['results'])
+            url = data['next']
+        expected = list(Product.objects.order_by('name', 'price', 'pk').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_count_is_optional(self):
+        data = self.client.get(reverse('shopapp:products-list'), {'count': 'true'}).json()
+        self.assertEqual(data['count'], 4)
+
+    def test_pages_through_more_ties_than_the_offset_cutoff(self):
+        Product.objects.bulk_create([
+            Product(name=f'Tied {number:04}', price=20, created_by=self.user)
+            for number in range(ProductCursorPagination.offset_cutoff + 100)
+        ])
+        url = reverse('shopapp:products-list') + '?ordering=price&page_size=100'
+        seen = []
+        pages = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                data = self.client.get(url).json()
+            pages.append(url)
+            seen.extend(product['id'] for product in data['results'])
+            url = data['next']
+        expected = list(Product.objects.order_by('price', 'pk').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+        # Deep pages start at the cursor instead of skipping the rows before it
+        self.assertFalse(any('OFFSET' in query['sql'] for query in queries.captured_queries))
+
+        # And back again from the last page
+        data = self.client.get(pages[-1]).json()
+        back = [product['id'] for product in data['results']]
+        url = data['previous']
+        while url:
+            data = self.client.get(url).json()
+            back[:0] = [product['id'] for product in data['results']]
+            url = data['previous']
+        self.assertEqual(back, expected)
+
+    def test_invalid_cursor_is_not_found(self):
+        # LocaleMiddleware redirects 404s to the URL with the language prefix first
+        response = self.client.get(reverse('shopapp:products-list'), {'cursor': 'bm90IGpzb24='}, follow=True)
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProductListCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cache_test', password='qwerty')
+        cls.product = Product.objects.create(name='Laptop', price=999, created_by=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_names(self):
+        response = self.client.get(reverse('shopapp:products-list'))
+        return [product['name'] for product in response.json()['results']]
+
+    def test_list_is_served_from_cache(self):
+        # The lookups are counted in the metrics of the process, which other tests add to
+        before = get_catalog_cache_stats()
+        self.get_names()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_names(), ['Laptop'])
+        stats = get_catalog_cache_stats()
+        self.assertEqual((stats['hits'] - before['hits'], stats['misses'] - before['misses']), (1, 1))
+        self.assertNotIn('shopapp:catalog-cache:hits', cache)
+
+    def test_version_is_bumped_after_commit(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.product.name = 'Notebook'
+            self.product.save()
+            # Readers still see the old version while the transaction is open
+            self.assertEqual(get_catalog_version(), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_cache_stats_are_for_staff_only(self):
+        url = reverse('shopapp:products-cache-stats')
+        self.assertIn(self.client.get(url).status_code, (401, 403))
+        self.user.is_staff = True
+        self.user.save()
+        token = AccessToken.for_user(self.user)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=f'JWT {token}').status_code, 200)
+
+    def test_product_changes_invalidate_cache(self):
+        self.get_names()
+        self.product.name = 'Notebook'
+        # The catalog version is bumped after the commit
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.get_names(), ['Notebook'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Desktop', price=1999, created_by=self.user)
+        self.assertEqual(self.get_names(), ['Desktop', 'Notebook'])
+
+
+class CatalogStatsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='stats_test', password='qwerty')
+
+    def assertStatsMatchTable(self):
+        stats = get_catalog_stats()
+        rebuild_catalog_stats()
+        self.assertEqual(stats, get_catalog_stats())
+        return stats
+
+    def test_stats_follow_product_changes(self):
+        laptop = Product.objects.create(name='Laptop', price=999, discount=5, created_by=self.user)
+        Product.objects.create(name='Cable', price=5, created_by=self.user)
+        stats = self.assertStatsMatchTable()
+        self.assertEqual((stats['total'], stats['active'], stats['archived']), (2, 2, 0))
+        self.assertEqual(stats['price']['500-1000'], 1)
+        self.assertEqual(stats['discount']['1-10'], 1)
+
+        laptop.price = 1200
+        laptop.save()
+        update_products(Product.objects.filter(name='Cable'), archived=True, discount=30)
+        stats = self.assertStatsMatchTable()
+        self.assertEqual((stats['total'], stats['active'], stats['archived']), (2, 1, 1))
+        self.assertEqual(stats['price']['1000+'], 1)
+        self.assertEqual(stats['discount']['26-50'], 1)
+
+        laptop.delete()
+        stats = self.assertStatsMatchTable()
+        self.assertEqual(stats['total'], 1)
+
+    def test_counter_created_concurrently(self):
+        CatalogCounter.objects.create(name='total', value=1)
+        original_update = QuerySet.update
+        calls = []
+
+        def update(queryset, **kwargs):
+            # The first update runs before the other transaction created the row
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else original_update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', update):
+            apply_deltas({'total': 2})
+        self.assertEqual(CatalogCounter.objects.get(name='total').value, 3)
+
+    def test_shop_index_reads_counter(self):
+        Product.objects.create(name='Laptop', price=999, created_by=self.user)
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            response = self.client.get(reverse('shopapp:index'))
+        self.assertEqual(response.context['items'], 1)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProductsListViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='list_test', password='qwerty')
+        for number in range(30):
+            Product.objects.create(name=f'Product {number:02}', price=number, created_by=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_products_are_paginated(self):
+        response = self.client.get(reverse('shopapp:products_list'))
+        self.assertEqual(len(response.context['products']), 24)
+        self.assertContains(response, 'There are 30 products')
+        response = self.client.get(reverse('shopapp:products_list'), {'page': 2})
+        self.assertEqual(len(response.context['products']), 6)
+
+    def test_product_card_is_invalidated_on_change(self):
+        self.client.get(reverse('shopapp:products_list'))
+        product = Product.objects.get(name='Product 00')
+        product.name = 'Renamed product'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        response = self.client.get(reverse('shopapp:products_list'), {'page': 2})
+        self.assertContains(response, 'Renamed product')
+        self.assertNotContains(response, 'Product 00')
+
+
+class ProductPreviewVariantsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='preview_test', password='qwerty')
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create_product(self, name='Desk'):
+        image = BytesIO()
+        Image.new('RGB', (800, 600), 'red').save(image, 'PNG')
+        preview = SimpleUploadedFile('desk.png', image.getvalue(), content_type='image/png')
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(name=name, created_by=self.user, preview=preview)
+
+    @override_settings(PREVIEW_VARIANTS_IN_REQUEST=True)
+    def test_variants_are_rendered_after_upload(self):
+        product = self.create_product()
+
+        product.refresh_from_db()
+        urls = product.preview_variant_urls()
+        self.assertEqual(sorted(urls), [160, 320, 640])
+        with Image.open(product.preview.storage.path(product.preview_variants['widths']['320'])) as variant:
+            self.assertEqual(variant.size, (320, 240))
+        self.assertIn(' 160w, ', product.preview_srcset())
+
+    def test_worker_renders_pending_previews(self):
+        product = self.create_product()
+        product.refresh_from_db()
+        self.assertEqual(product.preview_variant_urls(), {})
+
+        out = StringIO()
+        call_command('generate_preview_variants', workers=1, stdout=out)
+        self.assertIn('Rendered variants of 1 products, 0 failed', out.getvalue())
+        product.refresh_from_db()
+        self.assertEqual(sorted(product.preview_variant_urls()), [160, 320, 640])
+
+        out = StringIO()
+        call_command('generate_preview_variants', workers=1, stdout=out)
+        self.assertIn('Rendered variants of 0 products', out.getvalue())
+
+    @override_settings(
+        PREVIEW_VARIANTS_IN_REQUEST=True,
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    )
+    def test_product_list_does_not_load_variants_per_product(self):
+        for number in range(3):
+            self.create_product(name=f'Desk {number}')
+        cache.clear()
+        # Session, catalog counters and the products, the variants come with the products
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('shopapp:products_list'))
+        self.assertContains(response, ' 160w, ', count=3)
+
+
+class OrderViewSetQueriesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='orders_api_test', password='qwerty')
+        products = [
+            Product.objects.create(name=f'Product {number}', price=number, created_by=cls.user)
+            for number in range(3)
+        ]
+        for number in range(6):
+            order = Order.objects.create(user=cls.user, delivery_address=f'Street {number}')
+            order.products.set(products[:number % 3 + 1])
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        # One query for the ETag, one for the page of orders with their users and one for the products
+        for page_size in (2, 6):
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('shopapp:orders-list'), {'page_size': page_size})
+            self.assertEqual(len(response.json()['results']), page_size)
+
+    def test_orders_have_nested_user_and_products(self):
+        order = self.client.get(reverse('shopapp:orders-list')).json()['results'][0]
+        self.assertEqual(order['user']['username'], 'orders_api_test')
+        self.assertEqual(set(order['products'][0]), {'id', 'name', 'price', 'discount'})
+
+
+class OrderSummaryTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='order_summary_test', password='qwerty')
+        cls.desk = Product.objects.create(name='Desk', price='100.00', discount=10, created_by=cls.user)
+        cls.lamp = Product.objects.create(name='Lamp', price='20.50', created_by=cls.user)
+
+    def summary(self, order):
+        order.refresh_from_db()
+        return order.items_count, order.total, order.discounted_total
+
+    def test_summary_follows_order_items_and_prices(self):
+        order = Order.objects.create(user=self.user)
+        order.products.add(self.desk, self.lamp)
+        self.assertEqual(self.summary(order), (2, Decimal('120.50'), Decimal('110.50')))
+
+        self.lamp.price = '30.00'
+        self.lamp.save()
+        self.assertEqual(self.summary(order), (2, Decimal('130.00'), Decimal('120.00')))
+
+        update_products(Product.objects.filter(pk=self.desk.pk), discount=50)
+        self.assertEqual(self.summary(order), (2, Decimal('130.00'), Decimal('80.00')))
+
+        self.desk.orders.remove(order)
+        self.assertEqual(self.summary(order), (1, Decimal('30.00'), Decimal('30.00')))
+
+        order.products.clear()
+        self.assertEqual(self.summary(order), (0, Decimal('0.00'), Decimal('0.00')))
+
+    def test_api_filters_and_orders_by_total(self):
+        small = Order.objects.create(user=self.user)
+        small.products.add(self.lamp)
+        large = Order.objects.create(user=self.user)
+        large.products.add(self.desk, self.lamp)
+
+        response = self.client.get(reverse('shopapp:orders-list'), {'ordering': '-total'})
+        self.assertEqual([order['id'] for order in response.json()['results']], [large.pk, small.pk])
+
+        response = self.client.get(reverse('shopapp:orders-list'), {'total__gte': '50'})
+        self.assertEqual([order['id'] for order in response.json()['results']], [large.pk])
+
+
+class OrderBulkCreateTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='bulk_orders_test', password='qwerty')
+        cls.desk = Product.objects.create(name='Desk', price='100.00', discount=10, created_by=cls.user)
+        cls.lamp = Product.objects.create(name='Lamp', price='20.50', created_by=cls.user)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_creates_valid_orders_and_reports_invalid_ones(self):
+        items = [
+            {'delivery_address': 'Street 1', 'products': [self.desk.pk, self.lamp.pk, self.lamp.pk]},
+            {'products': []},
+            {'promocode': 'promo', 'products': [self.lamp.pk, 999999]},
+            {'user': self.user.pk, 'products': [self.lamp.pk]},
+        ]
+        response = self.client.post(reverse('shopapp:orders-bulk-create'), items, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        summary = response.json()
+        self.assertEqual((summary['created'], summary['rejected']), (2, 2))
+        self.assertEqual([error['index'] for error in summary['errors']], [1, 2])
+        self.assertIn('products', summary['errors'][1]['errors'])
+
+        first, second = Order.objects.filter(pk__in=summary['orders']).order_by('pk')
+        self.assertEqual(set(first.products.values_list('pk', flat=True)), {self.desk.pk, self.lamp.pk})
+        self.assertEqual(
+            (first.user, first.items_count, first.total, first.discounted_total),
+            (self.user, 2, Decimal('120.50'), Decimal('110.50')),
+        )
+        self.assertEqual(second.items_count, 1)
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        items = [{'products': [self.desk.pk, self.lamp.pk]} for _ in range(50)]
+        # Products, savepoint, orders, product links and release, no user is looked up
+        with self.assertNumQueries(5):
+            response = self.client.post(reverse('shopapp:orders-bulk-create'), items, format='json')
+        self.assertEqual(response.json()['created'], 50)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SeedDataCommandTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_seeds_consistent_data(self):
+        call_command('seed_data', size='tiny', seed=1, batch_size=64, stdout=StringIO())
+
+        self.assertEqual(User.objects.filter(username__startswith='seed_').count(), 20)
+        self.assertEqual(Product.objects.count(), 200)
+        self.assertEqual(Order.objects.count(), 300)
+        self.assertEqual(Article.objects.count(), 100)
+        self.assertTrue(self.client.login(username='seed_0', password='password'))
+
+        # The stored totals match the linked products
+        orders = Order.objects.order_by('pk')
+        summaries = compute_summaries([order.pk for order in orders])
+        for order in orders:
+            self.assertEqual((order.items_count, order.total, order.discounted_total), tuple(summaries[order.pk]))
+        self.assertEqual(get_catalog_stats()['total'], 200)
+        product = Product.objects.first()
+        self.assertIn(product, search_products(Product.objects.all(), product.name))
+
+    def test_same_seed_generates_same_data(self):
+        names = []
+        for _ in range(2):
+            call_command('seed_data', size='tiny', seed=7, stdout=StringIO())
+            names.append(list(Product.objects.order_by('pk').values_list('name', 'price', 'discount')))
+            Order.objects.all().delete()
+            Product.objects.all().delete()
+        self.assertEqual(names[0], names[1])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class BenchmarkRoutesCommandTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output = os.path.join(directory.name, 'results.json')
+
+    def test_writes_results_and_flags_regressions(self):
+        user = User.objects.create_user(username='benchmark_test', password='qwerty')
+        Product.objects.create(name='Desk', price=10, created_by=user)
+        cache.set('benchmark:untouched', 1)
+        call_command(
+            'benchmark_routes', current_db=True, iterations=3, warmup=0,
+            routes=['product-detail', 'api-product-list'], output=self.output, stdout=StringIO(),
+        )
+        with open(self.output) as file:
+            results = json.load(file)
+        self.assertEqual(cache.get('benchmark:untouched'), 1)
+        metrics = results['sizes']['current']['product-detail']
+        self.assertEqual(metrics['status'], 200)
+        self.assertGreater(metrics['queries'], 0)
+        self.assertLessEqual(metrics['p50_ms'], metrics['p99_ms'])
+
+        baseline = {'sizes': {'current': {'product-detail': dict(metrics, queries=metrics['queries'] - 1)}}}
+        self.assertEqual(
+            [(route, metric) for _, route, metric, _, _ in find_regressions(baseline, results, threshold=0.2)],
+            [('product-detail', 'queries')],
+        )
+
+    def test_percentile_uses_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual((percentile(values, 50), percentile(values, 95), percentile(values, 99)), (50, 95, 99))
+        self.assertEqual(percentile([3.0], 99), 3.0)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'mysite.cache_backends.LocMemCache'}})
+class RequestTimingMiddlewareTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='timing_test', password='qwerty')
+        cls.product = Product.objects.create(name='Desk', price=10, created_by=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_sends_server_timing_and_logs_route(self):
+        with self.assertLogs('mysite.middleware', level='INFO') as logs:
+            response = self.client.get(reverse('shopapp:products-list'), HTTP_X_REQUEST_ID='abc-123')
+
+        self.assertEqual(response['X-Request-ID'], 'abc-123')
+        timing = dict(
+            part.strip().split(';', 1)
+            for part in response['Server-Timing'].split(',')
+        )
+        self.assertEqual(set(timing), {'db', 'cache', 'tpl', 'total'})
+        self.assertRegex(timing['db'], r'dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertRegex(timing['cache'], r'desc="[1-9]\d* calls"')
+        record = logs.records[0]
+        self.assertEqual((record.route, record.request_id), ('shopapp:products-list', 'abc-123'))
+        self.assertGreater(record.timing['cache_misses'], 0)
+
+    def test_measures_templates_rendered_by_the_view(self):
+        with self.assertLogs('mysite.middleware', level='INFO') as logs:
+            self.client.get(reverse('shopapp:product_details', kwargs={'pk': self.product.pk}))
+        self.assertGreater(logs.records[0].timing['template_ms'], 0)
+
+    def test_counts_queries_of_streaming_responses(self):
+        with self.assertNoLogs('mysite.middleware', level='INFO'):
+            response = self.client.get(reverse('shopapp:products-download-csv'))
+        with self.assertLogs('mysite.middleware', level='INFO') as logs:
+            content = b''.join(response.streaming_content)
+        self.assertIn(b'Desk', content)
+        # The products are only read while the body is consumed
+        self.assertGreater(logs.records[0].timing['queries'], 0)
+        self.assertEqual(logs.records[0].route, 'shopapp:products-download-csv')
+
+    @override_settings(QUERY_BUDGETS={'shopapp:products-detail': 0})
+    def test_warns_when_query_budget_is_exceeded(self):
+        with self.assertLogs('mysite.middleware', level='WARNING') as logs:
+            self.client.get(reverse('shopapp:products-detail', kwargs={'pk': self.product.pk}))
+        self.assertIn('shopapp:products-detail', logs.output[0])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'mysite.cache_backends.LocMemCache'}})
+class MetricsEndpointTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='metrics_test', password='qwerty')
+        Product.objects.create(name='Desk', price=10, created_by=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir)
+
+    def sample(self, text, line_start):
+        for line in text.splitlines():
+            if line.startswith(line_start):
+                return float(line.rsplit(' ', 1)[1])
+        return 0.0
+
+    def test_sums_the_metrics_of_all_processes(self):
+        route = 'route="shopapp:products-download-csv",method="GET",status="200"'
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        with override_settings(METRICS_DIR=self.metrics_dir):
+            before = self.client.get(reverse('metrics')).content.decode()
+            response = self.client.get(reverse('shopapp:products-download-csv'))
+            b''.join(response.streaming_content)
+            # Another worker process exported 5 rows
+            with open(f'{self.metrics_dir}/1-other.json', 'w') as file:
+                json.dump({'csv_rows_total': [[['export', 'exported'], 5]]}, file)
+            response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        after = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', after)
+        exported = 'csv_rows_total{operation="export",result="exported"}'
+        self.assertEqual(self.sample(after, exported) - self.sample(before, exported), 6)
+        count = f'http_request_duration_seconds_count{{{route}}}'
+        self.assertEqual(self.sample(after, count) - self.sample(before, count), 1)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{route},le="+Inf"}}', after)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_only_staff_without_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_requires_the_token_when_configured(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+
+class TracesSamplerTestCase(TestCase):
+    def setUp(self):
+        sampling.boosted_until.clear()
+
+    def sample(self, path, **context):
+        return sampling.traces_sampler({'wsgi_environ': {'PATH_INFO': path}, **context})
+
+    def test_uses_route_rates(self):
+        self.assertEqual(self.sample(reverse('shopapp:products_list')), sampling.ROUTE_RATES['shopapp:products_list'])
+        self.assertEqual(self.sample(reverse('shopapp:order_create')), 1.0)
+        self.assertEqual(self.sample('/static/css/style.css'), 0.0)
+        self.assertEqual(self.sample(reverse('shopapp:products_list'), parent_sampled=True), 1.0)
+        self.assertEqual(
+            sampling.parse_rates('shopapp:index=0.5, blogapp:articles=2,broken=x'),
+            {'shopapp:index': 0.5, 'blogapp:articles': 1.0},
+        )
+
+    def test_boosts_routes_after_failed_requests(self):
+        path = reverse('shopapp:products_list')
+        sampling.report_request('shopapp:products_list', 0.01, 200)
+        self.assertLess(self.sample(path), 1.0)
+        sampling.report_request('shopapp:products_list', 0.01, 500)
+        self.assertEqual(self.sample(path), sampling.BOOST_SAMPLE_RATE)
+
+
+class LogHandlersTestCase(TestCase):
+    def test_queue_handler_writes_json_with_request_context(self):
+        stream = StringIO()
+        target = log_handlers.StreamHandler(stream)
+        target.setFormatter(log_handlers.JsonFormatter())
+        handler = log_handlers.QueueHandler([target])
+        logger = logging.getLogger('shopapp.tests.queue')
+        logger.addHandler(handler)
+        metrics = RequestMetrics('abc-123')
+        metrics.route = 'shopapp:index'
+        token = current_metrics.set(metrics)
+        try:
+            logger.warning('Rendered %s', 'index', extra={'timing': {'total_ms': 12.5}})
+            try:
+                raise ValueError('broken')
+            except ValueError:
+                logger.exception('Failed')
+        finally:
+            current_metrics.reset(token)
+            logger.removeHandler(handler)
+            # Stops the listener after the queued records are written
+            handler.close()
+
+        first, second = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(
+            (first['message'], first['request_id'], first['route'], first['duration_ms']),
+            ('Rendered index', 'abc-123', 'shopapp:index', 12.5),
+        )
+        self.assertIn('ValueError: broken', second['exception'])
+
+    def test_dropped_records_are_counted(self):
+        handler = log_handlers.QueueHandler([logging.NullHandler()], queue_size=1)
+        # Nothing takes the records off the queue
+        handler.listener.stop()
+        handler.listener = None
+        before = metrics_registry.snapshot().get('log_records_dropped_total', {}).get((), 0)
+        for number in range(3):
+            handler.handle(logging.makeLogRecord({'msg': f'line {number}'}))
+        handler.close()
+
+        self.assertEqual(handler.dropped, 2)
+        after = metrics_registry.snapshot()['log_records_dropped_total'][()]
+        self.assertEqual(after - before, 2)
+
+    def test_rotated_files_are_compressed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        handler = log_handlers.GzipRotatingFileHandler(f'{directory}/app.log', maxBytes=200, backupCount=2)
+        handler.setFormatter(log_handlers.JsonFormatter())
+        records = [
+            logging.makeLogRecord({'name': 'test', 'msg': f'line {number}', 'levelno': logging.INFO})
+            for number in range(10)
+        ]
+        handler.emit_batch(records)
+        handler.close()
+
+        with gzip.open(f'{directory}/app.log.1.gz', 'rt') as file:
+            self.assertIn('"logger": "test"', file.read())
+        self.assertFalse(os.path.exists(f'{directory}/app.log.1'))
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'two-tier-tests'},
+})
+class TwoTierCacheTestCase(TestCase):
+    def make_cache(self, **options):
+        # Every cache gets a store of its own, like a separate worker process
+        two_tier = cache_backends.TwoTierCache('shared', {'OPTIONS': {'JOURNAL_POLL_INTERVAL': 0, **options}})
+        two_tier.store = cache_backends.LocalStore(max_entries=options.get('LOCAL_MAX_ENTRIES', 1000), max_bytes=1024)
+        return two_tier
+
+    def setUp(self):
+        caches['shared'].clear()
+
+    def test_changes_of_other_processes_are_dropped_from_the_local_tier(self):
+        first, second = self.make_cache(), self.make_cache()
+        first.set('price', 10)
+        first.close()
+        self.assertEqual(second.get('price'), 10)
+        # Read from the local tier, the shared cache is not asked again
+        caches['shared'].set('price', 99)
+        self.assertEqual(second.get('price'), 10)
+
+        first.set('price', 12)
+        first.set('name', 'lamp')
+        # The changes of a request are announced with one journal entry when it ends
+        self.assertEqual(second.get('price'), 10)
+        first.close()
+        self.assertEqual(caches['shared'].get(cache_backends.JOURNAL_SEQUENCE_KEY), 2)
+        self.assertEqual(second.get('price'), 12)
+        first.delete('price')
+        first.close()
+        self.assertIsNone(second.get('price'))
+
+        second.set('name', 'desk')
+        first.clear()
+        self.assertIsNone(second.get('name'))
+
+    def test_local_tier_is_bounded(self):
+        two_tier = self.make_cache(LOCAL_MAX_ENTRIES=2, LOCAL_EXCLUDE_PREFIXES=['counter:'])
+        two_tier.set('a', 1)
+        two_tier.set('b', 2)
+        two_tier.get('a')
+        two_tier.set('c', 3)
+        # 'b' was the least recently used
+        self.assertEqual(list(two_tier.store.entries), [two_tier.make_key('a'), two_tier.make_key('c')])
+        self.assertEqual(two_tier.get('b'), 2)
+
+        two_tier.set('large', 'x' * 2048)
+        self.assertNotIn(two_tier.make_key('large'), two_tier.store.entries)
+        two_tier.add('counter:hits', 1)
+        two_tier.incr('counter:hits')
+        self.assertEqual(two_tier.get('counter:hits'), 2)
+        self.assertNotIn(two_tier.make_key('counter:hits'), two_tier.store.entries)
+
+    def test_file_based_add_and_incr_are_atomic(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        file_cache = cache_backends.FileBasedCache(directory.name, {})
+        results = []
+
+        def work():
+            results.append(file_cache.add('lock', 1))
+            file_cache.incr('lock')
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(file_cache.get('lock'), 9)
+
+    def test_file_based_cache_lists_the_directory_every_few_writes(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        file_cache = cache_backends.FileBasedCache(directory.name, {'OPTIONS': {'MAX_ENTRIES': 10, 'CULL_EVERY': 5}})
+        with mock.patch.object(file_cache, '_list_cache_files', wraps=file_cache._list_cache_files) as list_files:
+            for number in range(20):
+                file_cache.set(f'key-{number}', number)
+        self.assertEqual(list_files.call_count, 4)
+        # Culled when the listing found too many entries
+        self.assertLess(len(file_cache._list_cache_files()), 20)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CachePageSwrTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        self.lookups = []
+
+    def view(self, http_request):
+        self.calls += 1
+        return HttpResponse(f'render {self.calls}')
+
+    def test_expired_response_is_served_while_another_request_renews_it(self):
+        # Expires right away and stays around as stale for a minute
+        view = caching.cache_page_swr(
+            0, key_func=lambda http_request: 'swr-test', on_lookup=self.lookups.append,
+        )(self.view)
+        factory = RequestFactory()
+        lock_key = caching.get_lock_key('swr-test')
+        self.assertEqual(view(factory.get('/')).content, b'render 1')
+
+        cache.add(lock_key, 1)
+        self.assertEqual(view(factory.get('/')).content, b'render 1')
+        cache.delete(lock_key)
+        self.assertEqual(view(factory.get('/')).content, b'render 2')
+        self.assertEqual(self.lookups, [caching.MISS, caching.STALE, caching.MISS])
+        # The lock was released after storing the new response
+        self.assertIsNone(cache.get(lock_key))
+        self.assertEqual(view(factory.post('/')).content, b'render 3')
+
+    def test_waiting_request_takes_over_a_released_lock(self):
+        view = caching.cache_page_swr(60, key_func=lambda http_request: 'swr-test', wait_timeout=5)(self.view)
+        lock_key = caching.get_lock_key('swr-test')
+        # The request holding the lock ends without storing a response
+        cache.add(lock_key, 1)
+        timer = threading.Timer(0.1, cache.delete, [lock_key])
+        timer.start()
+        started = time.monotonic()
+        self.assertEqual(view(RequestFactory().get('/')).content, b'render 1')
+        timer.join()
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertIsNone(cache.get(lock_key))
+
+    def test_first_response_of_a_url_is_rendered_under_a_lock(self):
+        factory = RequestFactory()
+        # Locked by URL, CACHE_MIDDLEWARE_KEY_PREFIX is empty
+        lock_key = caching.get_lock_key(f":{factory.get('/swr/').build_absolute_uri()}")
+        locks = []
+
+        def view(http_request):
+            locks.append(cache.get(lock_key))
+            return self.view(http_request)
+
+        view = caching.cache_page_swr(60, on_lookup=self.lookups.append)(view)
+        # HEAD requests store the response for GET requests as well
+        self.assertEqual(view(factory.head('/swr/')).content, b'render 1')
+        self.assertEqual(view(factory.get('/swr/')).content, b'render 1')
+        self.assertEqual(locks, [1])
+        self.assertEqual(self.lookups, [caching.MISS, caching.HIT])
+        self.assertIsNone(cache.get(lock_key))
+
+    def test_function_view_is_cached_like_cache_page(self):
+        url = reverse('accounts:cookies_get')
+        first = self.client.get(url)
+        second = self.client.get(url)
+        self.assertEqual(first.content, second.content)
+        self.assertIn('max-age=62', first['Cache-Control'])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConditionalGetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='conditional_test', password='qwerty')
+        cls.product = Product.objects.create(name='Lamp', price=10, created_by=cls.user)
+        Product.objects.create(name='Desk', price=100, created_by=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_unchanged_product_answers_304_without_serializing(self):
+        url = reverse('myapiapp:product-detail', kwargs={'pk': self.product.pk})
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        # Only the aggregate runs
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        update_products(Product.objects.filter(pk=self.product.pk), price=12)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_etag_changes_with_the_products(self):
+        url = reverse('shopapp:products-list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        # Deleting a product would not move the newest timestamp of the list
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        last_modified = http_date(time.time() + 60)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([product['name'] for product in response.json()['results']], ['Desk'])
+
+    def test_order_depending_on_products_has_no_last_modified(self):
+        order = Order.objects.create(user=self.user, delivery_address='Street 1')
+        order.products.add(self.product)
+        response = self.client.get(reverse('shopapp:orders-detail', kwargs={'pk': order.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
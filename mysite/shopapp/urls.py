@@ -18,6 +18,7 @@ from .views import (
     OrderDeleteView,
     example_view,
     ProductViewSet, OrderViewSet,
+    ProductImportJobViewSet,
 )
 
 app_name = "shopapp"
@@ -26,6 +27,7 @@ routers = DefaultRouter()
 # routers.register("shops", ShopIndexView, basename="shops")
 routers.register("products", ProductViewSet, basename="products")
 routers.register("orders", OrderViewSet, basename="orders")
+routers.register("product-imports", ProductImportJobViewSet, basename="product-imports")
 
 urlpatterns = [
     path("api/", include(routers.urls)),
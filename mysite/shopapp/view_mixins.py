@@ -0,0 +1,88 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.http import HttpResponseNotModified
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from rest_framework.exceptions import APIException
+
+
+class NotModified(APIException):
+    # Raised by ConditionalGetMixin.initial() to skip the handler
+    status_code = 304
+
+
+class ConditionalGetMixin:
+    """
+    The `ConditionalGetMixin` class answers conditional GET requests of API views with 304.
+
+    The ``ETag`` of a list or detail response is computed from one aggregate
+    over the filtered queryset, the newest ``last_modified`` and the number
+    of rows, before anything is serialized. The model needs an indexed
+    ``last_modified`` field which bulk updates keep current as well.
+
+    ``Last-Modified`` is only sent for detail responses depending on nothing
+    but their row. Deleting a row from a list does not move the newest
+    timestamp, and changes of the data behind ``get_etag_parts()`` have none.
+    """
+    conditional_field = 'last_modified'
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.validators = None
+        if request.method not in ('GET', 'HEAD') or getattr(self, 'action', None) not in (None, 'list', 'retrieve'):
+            return
+        self.validators = self.get_validators()
+        if self.validators is None:
+            return
+        etag, last_modified = self.validators
+        if get_conditional_response(request._request, etag=etag, last_modified=last_modified) is not None:
+            raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return HttpResponseNotModified()
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        validators = getattr(self, 'validators', None)
+        if validators is not None and response.status_code in (200, 304):
+            etag, last_modified = validators
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def get_validators(self):
+        """
+        Return the ETag and the Last-Modified timestamp of the response,
+        None when there is nothing to compare, e.g. for a missing object.
+        The timestamp is None for lists and responses with ETag parts.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        detail = lookup_url_kwarg in self.kwargs
+        if detail:
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        state = queryset.order_by().aggregate(last_modified=Max(self.conditional_field), count=Count('pk'))
+        if state['last_modified'] is None:
+            return None
+        extra_parts = self.get_etag_parts()
+        parts = [
+            str(state['count']),
+            state['last_modified'].isoformat(),
+            self.request.accepted_renderer.format,
+            *extra_parts,
+        ]
+        etag = quote_etag(hashlib.md5(':'.join(parts).encode(), usedforsecurity=False).hexdigest())
+        last_modified = None
+        if detail and not extra_parts:
+            last_modified = int(state['last_modified'].timestamp())
+        return etag, last_modified
+
+    def get_etag_parts(self) -> list:
+        """
+        Return additional values the response depends on, e.g. versions of related data.
+        """
+        return []
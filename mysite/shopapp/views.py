@@ -1,4 +1,3 @@
-import csv
 import logging
 from timeit import default_timer
 
@@ -7,14 +6,16 @@ from django.contrib.auth.mixins import (LoginRequiredMixin,
                                         PermissionRequiredMixin,
                                         UserPassesTestMixin)
 from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db.models import Prefetch
 from django.http import (HttpResponse,
                          HttpRequest,
                          HttpResponseRedirect,
-                         HttpResponseForbidden)
+                         HttpResponseForbidden,
+                         StreamingHttpResponse)
 from django.shortcuts import render, redirect, reverse, get_object_or_404
 from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 from django.views.generic import (TemplateView,
                                   ListView,
                                   DetailView,
@@ -34,12 +35,25 @@ from rest_framework import generics, decorators, permissions, status, viewsets
 from rest_framework.request import Request
 from drf_spectacular.utils import extend_schema, OpenApiResponse
 
-from .serializers import ProductSerializer, OrderSerializer
+from mysite.caching import cache_page_swr
 
-from .forms import ProductForm, OrderForm, GroupForm
-from .models import Product, Order
+from .serializers import ProductSerializer, OrderSerializer, OrderReadSerializer, ProductImportJobSerializer
 
-from .common import save_csv_products
+from .forms import ProductForm, OrderForm, GroupForm
+from .models import Product, Order, ProductImportJob
+
+from .cache import (cache_catalog_response,
+                    get_catalog_cache_key,
+                    get_catalog_cache_stats,
+                    get_catalog_version,
+                    get_product_versions,
+                    CATALOG_CACHE_TIMEOUT,
+                    PRODUCT_CARD_CACHE_TIMEOUT)
+from .common import create_orders, iter_csv_rows, ORDER_BULK_MAX_ITEMS
+from .pagination import ProductCursorPagination, OrderCursorPagination, CountedPaginator
+from .search import ProductSearchFilter
+from .stats import get_catalog_stats
+from .view_mixins import ConditionalGetMixin
 
 log = logging.getLogger(__name__)
 
@@ -53,7 +67,7 @@ class ShopIndexView(View):
     - get(request: HttpRequest) -> HttpResponse: Renders the shop index page.
 
     """
-    @method_decorator(cache_page(60 * 2))
+    @method_decorator(cache_page_swr(60 * 2))
     def get(self, request: HttpRequest) -> HttpResponse:
         products = [
             ('Laptop', 1999),
@@ -63,12 +77,10 @@ class ShopIndexView(View):
         context = {
             "time_running": default_timer(),
             "products": products,
-            "items": len(Product.objects.all())
+            "items": get_catalog_stats()['total'],
         }
         log.debug('Products for shop index: %s', products)
         log.info("Rendering shop index page")
-
-        print('shop index context', context)
         return render(request, 'shopapp/shop-index.html', context=context)
 
 
@@ -182,6 +194,8 @@ class ProductsListView(ListView):
         Default is 'products'.
     - ``queryset``: (`QuerySet`) The queryset of products to be used for displaying the list. By default, it filters
         Product objects where archived=False.
+    - ``paginate_by``: (`int`) The number of products per page. The page count comes from the catalog counters
+        and every product card is cached as a template fragment keyed by the product version.
 
     """
     template_name = 'shopapp/products-list.html'
@@ -191,7 +205,32 @@ class ProductsListView(ListView):
     # return context
     # model = Product
     context_object_name = 'products'
-    queryset = Product.objects.filter(archived=False)
+    queryset = (
+        Product.objects
+        .filter(archived=False)
+        .only('pk', 'name', 'price', 'discount', 'preview', 'preview_variants')
+        .order_by('name', 'price', 'pk')
+    )
+    paginate_by = 24
+    paginator_class = CountedPaginator
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        # The number of active products is kept by the catalog counters
+        return super().get_paginator(
+            queryset, per_page, orphans, allow_empty_first_page,
+            count=get_catalog_stats()['active'], **kwargs,
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        products = list(context['products'])
+        versions = get_product_versions([product.pk for product in products])
+        for product in products:
+            # Part of the cache key of the product card fragment
+            product.card_version = versions[product.pk]
+        context['products'] = products
+        context['card_cache_timeout'] = PRODUCT_CARD_CACHE_TIMEOUT
+        return context
 
 
 class ProductCreateView(CreateView):
@@ -434,7 +473,7 @@ class OrdersListView(LoginRequiredMixin, ListView):
         - ListView: Provides the functionality to display a list of objects.
 
     Attributes:
-        - queryset (QuerySet): A QuerySet of orders, including related user and products.
+        - queryset (QuerySet): A QuerySet of orders, including the related user. The totals are stored on the orders.
         - context_object_name (str): The name of the variable to use in the template when rendering the list of orders.
 
     Example usage:
@@ -463,7 +502,6 @@ class OrdersListView(LoginRequiredMixin, ListView):
     queryset = (
         Order.objects
         .select_related("user")
-        .prefetch_related("products")
     )
     context_object_name = 'orders'
 
@@ -559,7 +597,7 @@ def example_view(request):
 
 # ----------- ViewSet ---------------------------
 @extend_schema(description="Product views CRUD")
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, ModelViewSet):
     """
     A viewset for handling CRUD operations on the Product model.
 
@@ -570,21 +608,23 @@ class ProductViewSet(ModelViewSet):
     - queryset: All products in the database. (QuerySet)
     - serializer_class: Serializer for the Product model. (Serializer)
     - filter_backends: List of filter backends used for filtering the queryset.
-      Includes SearchFilter, DjangoFilterBackend, and OrderingFilter. (list)
-    - search_fields: Fields used for searching products. (list)
+      Includes ProductSearchFilter, DjangoFilterBackend, and OrderingFilter. (list)
+    - search_fields: Fields used for searching products when the full-text index is not available. (list)
     - filterset_fields: Fields used for filtering products. (list)
     - ordering_fields: Fields used for ordering products. (list)
+    - pagination_class: Cursor pagination over the ordering fields. (class)
     """
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     filter_backends = [
-        SearchFilter,
+        ProductSearchFilter,
         DjangoFilterBackend,
         OrderingFilter,
     ]
     search_fields = ['name', 'description']
     filterset_fields = ['name', 'price', 'description', 'discount', 'archived']
     ordering_fields = ['name', 'price', 'description']
+    pagination_class = ProductCursorPagination
 
     @extend_schema(
         summary="Get one product by ID",
@@ -597,16 +637,30 @@ class ProductViewSet(ModelViewSet):
     def retrieve(self, *args, **kwargs):
         return super().retrieve(*args, **kwargs)
 
-    @method_decorator(cache_page(60 * 2))
+    def get_validators(self):
+        # Cached like the responses, a cached list is still served without queries
+        key = f'{get_catalog_cache_key(self.request)}:validators'
+        cached = cache.get(key)
+        if cached is None:
+            cached = [super().get_validators()]
+            cache.set(key, cached, CATALOG_CACHE_TIMEOUT)
+        return cached[0]
+
+    @method_decorator(cache_catalog_response())
     def list(self, *args, **kwargs):
         # print('Hello products list')
         return super().list(*args, **kwargs)
 
+    @action(detail=False, methods=["GET"])
+    def stats(self, request: Request):
+        return Response(get_catalog_stats())
+
+    @action(detail=False, methods=["GET"], permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request: Request):
+        return Response(get_catalog_cache_stats())
+
     @action(detail=False, methods=["GET"])
     def download_csv(self, request: Request):
-        response = HttpResponse(content_type='text/csv')
-        filename = 'products-export.csv'
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
         queryset = self.filter_queryset(self.get_queryset())
         fields = [
             'name',
@@ -614,30 +668,54 @@ class ProductViewSet(ModelViewSet):
             'price',
             'discount',
         ]
-        queryset = queryset.only(*fields)
-        writer = csv.DictWriter(response, fieldnames=fields)
-        writer.writeheader()
-
-        for product in queryset:
-            writer.writerow({
-                field: getattr(product, field)
-                for field in fields
-            })
-            # response is a file
-
+        # Rows are written to the client as they are read from the database
+        response = StreamingHttpResponse(
+            iter_csv_rows(queryset, fields),
+            content_type='text/csv',
+        )
+        filename = 'products-export.csv'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
 
-    @action(detail=False, methods=["POST"], parser_classes=[MultiPartParser], )
+    @action(
+        detail=False,
+        methods=["POST"],
+        parser_classes=[MultiPartParser],
+        permission_classes=[permissions.IsAuthenticated],
+    )
     def upload_csv(self, request: Request):
-        products = save_csv_products(
-            request.FILES['file'].file,
-            endcoding=request.encoding,
+        # The file is only stored here, the import worker processes it
+        upload = request.FILES['file']
+        job = ProductImportJob.objects.create(
+            file=upload,
+            encoding=request.encoding or 'utf-8',
+            created_by=request.user,
+            bytes_total=upload.size,
         )
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+        serializer = ProductImportJobSerializer(job)
+        headers = {
+            'Location': reverse('shopapp:product-imports-detail', kwargs={'pk': job.pk}),
+        }
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED, headers=headers)
 
 
-class OrderViewSet(ModelViewSet):
+class ProductImportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    A read-only viewset for polling the product CSV import jobs.
+
+    Users see their own jobs, staff users see all of them.
+    """
+    serializer_class = ProductImportJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = ProductImportJob.objects.all()
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(created_by=self.request.user)
+        return queryset
+
+
+class OrderViewSet(ConditionalGetMixin, ModelViewSet):
     """
 
     .. module:: order.views
@@ -648,22 +726,67 @@ class OrderViewSet(ModelViewSet):
     .. versionadded:: 1.0
 
     """
-    queryset = Order.objects.all()
+    queryset = (
+        Order.objects
+        .select_related('user')
+        .prefetch_related(
+            Prefetch('products', queryset=Product.objects.only('id', 'name', 'price', 'discount')),
+        )
+    )
     serializer_class = OrderSerializer
     filter_backends = [
         SearchFilter,
         DjangoFilterBackend,
         OrderingFilter,
     ]
-    search_fields = ['name', 'delivery_address', 'products']
-    filterset_fields = ['user', 'promocode', 'products', 'delivery_address']
-    ordering_fields = ['name']
+    search_fields = ['delivery_address', 'promocode']
+    filterset_fields = {
+        'user': ['exact'],
+        'promocode': ['exact'],
+        'products': ['exact'],
+        'delivery_address': ['exact'],
+        'items_count': ['exact', 'gte', 'lte'],
+        'total': ['gte', 'lte'],
+        'discounted_total': ['gte', 'lte'],
+    }
+    ordering_fields = ['created_at', 'items_count', 'total', 'discounted_total']
+    pagination_class = OrderCursorPagination
+
+    def get_serializer_class(self):
+        # Reads return nested users and products, writes still take primary keys
+        if self.action in ('list', 'retrieve'):
+            return OrderReadSerializer
+        return super().get_serializer_class()
+
+    def get_etag_parts(self) -> list:
+        # The nested products change without touching the orders, e.g. when renamed
+        return [str(get_catalog_version())]
+
+    @action(
+        detail=False,
+        methods=["POST"],
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def bulk_create(self, request: Request):
+        # Takes a JSON list of orders, invalid ones are reported by their index
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'detail': 'Expected a list of orders.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > ORDER_BULK_MAX_ITEMS:
+            return Response(
+                {'detail': f'At most {ORDER_BULK_MAX_ITEMS} orders can be created at once.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        summary = create_orders(items, user=request.user)
+        if items and not summary['created']:
+            return Response(summary, status=status.HTTP_400_BAD_REQUEST)
+        return Response(summary, status=status.HTTP_201_CREATED)
 
 
 # ------------End ViewSet -----------------------
 
 
-class ProductsListAPIView(ListCreateAPIView):
+class ProductsListAPIView(ConditionalGetMixin, ListCreateAPIView):
     """
 
     ProductsListAPIView
@@ -679,7 +802,7 @@ class ProductsListAPIView(ListCreateAPIView):
     serializer_class = ProductSerializer
 
 
-class ProductRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
+class ProductRetrieveUpdateDestroyAPIView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     ProductRetrieveUpdateDestroyAPIView Class
     ========================================
@@ -714,7 +837,7 @@ class ProductRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView)
     serializer_class = ProductSerializer
 
 
-class OrdersListViewAPIView(ListCreateAPIView):
+class OrdersListViewAPIView(ConditionalGetMixin, ListCreateAPIView):
     """
     A view to list and create orders.
 
@@ -732,7 +855,7 @@ class OrdersListViewAPIView(ListCreateAPIView):
     serializer_class = OrderSerializer
 
 
-class OrderRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
+class OrderRetrieveUpdateDestroyAPIView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     View to retrieve, update and destroy an order.
 